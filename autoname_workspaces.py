@@ -4,7 +4,8 @@
 #
 # This script listens for i3 events and updates workspace names to show icons
 # for running programs.  It contains icons for a few programs, but more can
-# easily be added by editing the WINDOW_ICONS list below.
+# easily be added by editing the WINDOW_ICONS list below, or in a JSON file
+# given with --icon_config, which can be changed without restarting the script.
 #
 # It also re-numbers workspaces in ascending order with one skipped number
 # between monitors (leaving a gap for a new workspace to be created). By
@@ -12,7 +13,9 @@
 #
 # Dependencies
 # * xorg-xprop  - install through system package manager
-# * i3ipc       - install with pip
+# * i3ipc       - install with pip.  Tested with 2.x; the rename passes read
+#                 the tree with its private Connection._message() when it's
+#                 there (see i3tree.get_tree()).
 # * fontawesome - install with pip
 #
 # Installation:
@@ -28,14 +31,37 @@
 #   bindsym $mod+1 workspace 1
 # To:
 #   bindsym $mod+1 workspace number 1
+#
+# Several i3 instances:
+# Pass --i3_socket once per instance to serve them all from one process, e.g.
+#   autoname_workspaces.py --i3_socket=$(i3 --get-socketpath) \
+#       --i3_socket=/tmp/xephyr-i3.sock=:2
+#
+# Status bars:
+# Start the script with --state_socket to have it stream the workspaces to
+# status bar blocks as JSON, instead of them polling i3.  See workspace_state.py.
+#
+# Shortnames:
+# Start the script with --shortnames to have it remember the shortnames of
+# workspaces across sessions and give them back when it starts.  See
+# shortname_store.py.
+#
+# Metrics:
+# Send the script SIGUSR1 to log how long it takes to handle each kind of event,
+# or run "./control.py stats" when it was started with --control_socket.  See
+# metrics.py.
 
-import argparse
+import contextlib
 import i3ipc
 import logging
+import re
 import signal
 import sys
 import fontawesome as fa
 
+import i3tree
+import icon_rules
+import metrics
 from util import *
 
 # Add icons here for common programs you use.  The keys are the X window class
@@ -114,70 +140,450 @@ WINDOW_ICONS = {
     'zoom': fa.icons['comment'],
 }
 
+# More flexible rules for windows that can't be matched by their exact class
+# alone.  Rules can match the window class, instance or title, exactly, with a
+# glob, or with a regex, and a higher priority wins when several match.  They
+# take precedence over WINDOW_ICONS only if given a priority above 0.  See
+# icon_rules.py for details.  For example:
+#
+#   icon_rules.glob('jetbrains-*', fa.icons['code'], field='class'),
+#   icon_rules.regex('.* - vim', fa.icons['code'], field='title', priority=1),
+ICON_RULES = []
+
 # This icon is used for any application not in the list above
 DEFAULT_ICON = '*'
 
+# A JSON file with more icons (see icon_rules.load_config()), which win ties
+# with the ones above, e.g. when both have an icon for the same class.  Set
+# with --icon_config.  The script picks up changes to it while running.  Icons
+# can be given as text or as "fa:<name>" for a font awesome icon.
+ICON_CONFIG = None
+
 # Global setting that determines whether workspaces will be automatically
 # re-numbered in ascending order with a "gap" left on each monitor. This is
 # overridden via command-line flag.
 RENUMBER_WORKSPACES = True
 
 
-def ensure_window_icons_lowercase():
-    global WINDOW_ICONS
-    WINDOW_ICONS = {name.lower(): icon for name, icon in WINDOW_ICONS.items()}
+# Caches the WM_CLASS of every X window, keyed by X window id. Entries are
+# filled once when a window is created (window::new) and dropped when it is
+# closed (window::close), so a rename pass doesn't have to fork xprop for each
+# window on every event. The class and instance that i3 already reports in its
+# tree are preferred; xprop is only used for windows where i3 has neither.
+class WindowClassCache:
+    def __init__(self):
+        self._classes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._classes)
+
+    # Returns the WM_CLASS of the given window container as an (instance,
+    # class) pair, the same order xprop reports them in.
+    def get(self, window):
+        if window.window is None:
+            # e.g. an i3 placeholder container waiting to swallow a window
+            return ('', '')
+        classes = self._classes.get(window.window)
+        if classes is not None:
+            self.hits += 1
+            return classes
+        self.misses += 1
+        return self.add(window)
+
+    # Resolve and store the classes for a window.  Called from window::new
+    # events, but also on a cache miss for windows that existed before this
+    # script was started.  A failed xprop lookup isn't stored, so that it's
+    # tried again on the next pass.
+    def add(self, window):
+        if window.window_instance or window.window_class:
+            classes = (window.window_instance or '', window.window_class or '')
+        else:
+            values = xprop(window.window, 'WM_CLASS')
+            if values is None:
+                return ('', '')
+            classes = _wm_class(values)
+        self._classes[window.window] = classes
+        return classes
+
+    # Resolves all of the given windows that aren't cached yet and that i3
+    # doesn't report a class for with a single batched X request, rather than
+    # one xprop lookup per window.
+    def prefetch(self, windows):
+        missing = [
+            w.window for w in windows
+            if w.window is not None and w.window not in self._classes
+            and not (w.window_class or w.window_instance)
+        ]
+        if missing:
+            for win_id, classes in xprop_many(missing, 'WM_CLASS').items():
+                if classes is not None:
+                    self._classes[win_id] = _wm_class(classes)
+
+    def drop(self, win_id):
+        self._classes.pop(win_id, None)
+
+    # Forgets every window that isn't in the given ids, e.g. ones that closed
+    # while i3 was restarting.
+    def retain(self, win_ids):
+        win_ids = set(win_ids)
+        for win_id in [w for w in self._classes if w not in win_ids]:
+            del self._classes[win_id]
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+# Turns the values of an xprop WM_CLASS lookup into an (instance, class) pair.
+def _wm_class(values):
+    values = [str(v) for v in values or []][:2]
+    return tuple(values + [''] * (2 - len(values)))
+
+
+WINDOW_CLASSES = WindowClassCache()
+
+# Event latencies, ipc round trips, renames and memory use of this process.
+# Dumped to the log on SIGUSR1 and served by the control socket's "stats"
+# command.
+METRICS = metrics.Metrics()
+
+# The workspaces streamed to status bars with --state_socket (a
+# workspace_state.WorkspaceState), or None.
+WORKSPACE_STATE = None
+
+# The shortnames remembered across sessions with --shortnames (a
+# shortname_store.ShortnameStore), or None.
+SHORTNAMES = None
+
+# The compiled form of WINDOW_ICONS, ICON_RULES and ICON_CONFIG, see
+# compile_window_icons().
+ICONS = None
+
+# The IconMatcher most recently compiled from a changed ICON_CONFIG by
+# watch_icon_config(), until swap_icons() makes it the current one.
+PENDING_ICONS = None
+
+# The payload of the tick that watch_icon_config() sends to i3 to get the event
+# loop to swap in PENDING_ICONS.
+RELOAD_ICONS_TICK = 'i3scripts:reload-icons'
+
+
+def _resolve_icon(icon):
+    if icon.startswith('fa:'):
+        if icon[3:] not in fa.icons:
+            raise ValueError('Unknown font awesome icon: %s' % icon[3:])
+        return fa.icons[icon[3:]]
+    return icon
+
+
+# Compiles ICON_CONFIG (if set), ICON_RULES and WINDOW_ICONS into a new
+# IconMatcher.  Raises OSError or ValueError if ICON_CONFIG can't be loaded.
+def build_icon_matcher():
+    rules = ICON_RULES + icon_rules.rules_from_dict(WINDOW_ICONS)
+    default = DEFAULT_ICON
+    if ICON_CONFIG is not None:
+        config_rules, config_default = icon_rules.load_config(
+            ICON_CONFIG, _resolve_icon)
+        # earlier rules win ties
+        rules = config_rules + rules
+        default = config_default or default
+    try:
+        return icon_rules.IconMatcher(rules, default)
+    except re.error as e:
+        raise ValueError('Invalid icon rule pattern: %s' % e)
+
+
+# Compiles the icons into ICONS.  This happens once at startup; later changes to
+# ICON_CONFIG go through watch_icon_config() and swap_icons().
+def compile_window_icons():
+    global ICONS
+    ICONS = build_icon_matcher()
+    return ICONS
+
+
+# Polls ICON_CONFIG every 'interval' seconds from a daemon thread.  When it has
+# changed, compiles it into PENDING_ICONS off the event loop and sends a tick
+# to each of the given i3 sockets (None for the default one), so that their
+# event loops swap it in with swap_icons() between two rename passes.  A file
+# that doesn't load is logged and the current icons are kept.
+def watch_icon_config(socket_paths=[None], interval=2.0):
+    import os
+    import threading
+    import time
+
+    def stat():
+        try:
+            st = os.stat(ICON_CONFIG)
+        except OSError:
+            return None
+        # editors often replace the file instead of writing to it
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def run():
+        global PENDING_ICONS
+        last = stat()
+        while True:
+            time.sleep(interval)
+            current = stat()
+            if current is None or current == last:
+                continue
+            last = current
+            try:
+                PENDING_ICONS = build_icon_matcher()
+            except (OSError, ValueError) as e:
+                logging.warning('Keeping the current icons: %s' % e)
+                continue
+            for socket_path in socket_paths:
+                try:
+                    i3 = LiteConnection(socket_path)
+                    try:
+                        i3.send_tick(RELOAD_ICONS_TICK)
+                    finally:
+                        i3.close()
+                except Exception as e:
+                    logging.warning('Unable to reach i3 to reload icons: %s' %
+                                    e)
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+# Makes PENDING_ICONS the current icons, if it's newer.  The tick that
+# announced it is then handled with a full rename pass, which renames only the
+# workspaces whose icons changed.  Window classes stay cached.
+def swap_icons():
+    global ICONS
+    pending = PENDING_ICONS
+    if pending is not None and pending is not ICONS:
+        ICONS = pending
+        logging.info('Reloaded the icons from %s' % ICON_CONFIG)
+
+
+def is_reload_icons_tick(e):
+    return (isinstance(e, i3ipc.TickEvent)
+            and e.payload == RELOAD_ICONS_TICK)
+
+
+# Whether a window event with the given 'change' can affect workspace names.
+# Title changes only matter if there are title rules.
+def handles_window_change(change):
+    if change == 'title':
+        return (ICONS or compile_window_icons()).uses_titles
+    return change in ['new', 'close', 'move']
 
 
 def icon_for_window(window):
-    # Try all window classes and use the first one we have an icon for
-    classes = xprop(window.window, 'WM_CLASS')
-    if classes != None and len(classes) > 0:
-        for cls in classes:
-            cls = cls.lower()  # case-insensitive matching
-            if cls in WINDOW_ICONS:
-                return WINDOW_ICONS[cls]
-    logging.info('No icon available for window with classes: %s' %
-                 str(classes))
-    return DEFAULT_ICON
+    instance, cls = WINDOW_CLASSES.get(window)
+    matcher = ICONS or compile_window_icons()
+    return matcher.icon(cls, instance, window.name)
 
 
-# renames all workspaces based on the windows present
-# also renumbers them in ascending order, with one gap left between monitors
-# for example: workspace numbering on two monitors: [1, 2, 3], [5, 6]
-def rename_workspaces(i3, icon_list_format='default'):
-    ws_infos = i3.get_workspaces()
-    prev_output = None
-    n = 1
-    for ws_index, workspace in enumerate(i3.get_tree().workspaces()):
-        ws_info = ws_infos[ws_index]
+# Yields a (workspace, output name) pair for each workspace in the tree, in the
+# order they're shown on the bar.
+def workspaces_by_output(tree):
+    for output in tree.nodes:
+        if output.name.startswith('__'):
+            continue
+        for con in output.nodes:
+            for workspace in con.nodes:
+                if (workspace.type == 'workspace'
+                        and not workspace.name.startswith('__')):
+                    yield workspace, output.name
 
-        name_parts = parse_workspace_name(workspace.name)
-        icon_list = [icon_for_window(w) for w in workspace.leaves()]
-        new_icons = format_icon_list(icon_list, icon_list_format)
 
+# What the last full rename pass saw.  This lets a window event be handled by
+# renaming only the workspaces it touched, as long as the set and order of
+# workspaces (and therefore their numbering) hasn't changed.
+class RenameState:
+    def __init__(self):
+        # [(workspace con id, output name)] in bar order, or None before the
+        # first full pass
+        self.layout = None
+        # workspace con id -> workspace number
+        self.nums = {}
+        # X window id -> id of the workspace con it was last seen on
+        self.window_workspace = {}
+
+
+STATE = RenameState()
+
+
+# The per-display state for one of several i3 instances served by the same
+# process (see run_instances()): its RenameState, WindowClassCache, Metrics
+# and xprop backend.  The functions in this file use the module globals, so
+# active() swaps this instance's state in for as long as it's held, which must
+# not span an await.  What's derived from the configuration (the compiled icon
+# rules and the memoized icon list formatters) is shared by all instances.
+class Instance:
+    def __init__(self, socket_path, display_name=None):
+        self.socket_path = socket_path
+        self.display_name = display_name
+        self.state = RenameState()
+        self.window_classes = WindowClassCache()
+        self.metrics = metrics.Metrics()
+        # None to use $DISPLAY, like a single instance would
+        self.xprop = (new_xprop_backend(display_name)
+                      if display_name is not None else None)
+        # set by run_aio(): a coroutine function that removes the icons and
+        # disconnects
+        self.quit = None
+
+    # Parses a --i3_socket argument: PATH or PATH=DISPLAY.
+    @classmethod
+    def parse(cls, arg):
+        socket_path, _, display_name = arg.partition('=')
+        return cls(socket_path, display_name or None)
+
+    @contextlib.contextmanager
+    def active(self):
+        global STATE, WINDOW_CLASSES, METRICS
+        saved = STATE, WINDOW_CLASSES, METRICS
+        STATE, WINDOW_CLASSES, METRICS = (self.state, self.window_classes,
+                                          self.metrics)
+        xprop = (set_xprop_backend(self.xprop)
+                 if self.xprop is not None else None)
+        try:
+            yield self
+        finally:
+            STATE, WINDOW_CLASSES, METRICS = saved
+            if self.xprop is not None:
+                set_xprop_backend(xprop)
+
+
+# Recompute the icons for a single workspace.  Returns an (old_name, new_name)
+# pair if it needs to be renamed, or None if nothing changed.  'shortname' is
+# given to the workspace if it doesn't have one.
+def plan_workspace_rename(workspace, num, icon_list_format='default',
+                          leaves=None, shortname=None):
+    name_parts = parse_workspace_name(workspace.name)
+    if leaves is None:
+        leaves = workspace.leaves()
+    for w in leaves:
+        if w.window is not None:
+            STATE.window_workspace[w.window] = workspace.id
+    icon_list = tuple(icon_for_window(w) for w in leaves)
+    new_icons = format_icon_list(icon_list, icon_list_format)
+
+    new_name = construct_workspace_name(
+        NameParts(num=num,
+                  shortname=name_parts.shortname or shortname,
+                  icons=new_icons))
+    if workspace.name == new_name:
+        return None
+    return (workspace.name, new_name)
+
+
+# Puts renames in an order that i3 can apply without name collisions, see
+# util.plan_rename_order().
+def _ordered(renames):
+    plan = plan_rename_order(renames)
+    if plan.cycles:
+        logging.debug('%d renames with %d temporary names' %
+                      (plan.cost, plan.cycles))
+    return plan.renames
+
+
+# Plans the renames for all workspaces based on the windows present.  Also
+# renumbers them in ascending order, with one gap left between monitors.
+# For example: workspace numbering on two monitors: [1, 2, 3], [5, 6]
+# Workspaces without a shortname get the one in 'shortnames' (a
+# shortname_store.ShortnameStore) for their new number, if given.
+# Returns a list of (old_name, new_name) pairs.
+def plan_renames(tree, icon_list_format='default', shortnames=None):
+    STATE.layout = []
+    STATE.nums.clear()
+    STATE.window_workspace.clear()
+
+    workspaces = [(workspace, output, workspace.leaves())
+                  for workspace, output in workspaces_by_output(tree)]
+    WINDOW_CLASSES.prefetch(w for _, _, leaves in workspaces for w in leaves)
+
+    renames = []
+    prev_output = None
+    n = 1
+    for workspace, output, leaves in workspaces:
         # As we enumerate, leave one gap in workspace numbers between each monitor.
         # This leaves a space to insert a new one later.
-        if ws_info.output != prev_output and prev_output != None:
+        if output != prev_output and prev_output != None:
             n += 1
-        prev_output = ws_info.output
+        prev_output = output
 
         # optionally renumber workspace
-        new_num = n if RENUMBER_WORKSPACES else name_parts.num
+        num = n if RENUMBER_WORKSPACES else parse_workspace_name(
+            workspace.name).num
         n += 1
 
-        new_name = construct_workspace_name(
-            NameParts(num=new_num,
-                      shortname=name_parts.shortname,
-                      icons=new_icons))
-        if workspace.name == new_name:
-            continue
-        i3.command('rename workspace "%s" to "%s"' %
-                   (workspace.name, new_name))
+        STATE.layout.append((workspace.id, output))
+        STATE.nums[workspace.id] = num
+        shortname = None
+        if shortnames is not None and num is not None:
+            shortname = shortnames.shortname(output, int(num))
+        renames.append(
+            plan_workspace_rename(workspace, num, icon_list_format, leaves,
+                                  shortname))
 
+    logging.debug('window class cache: %s' % WINDOW_CLASSES.stats())
+    return _ordered([r for r in renames if r is not None])
 
-# Rename workspaces to just numbers and shortnames, removing the icons.
-def on_exit(i3):
-    for workspace in i3.get_tree().workspaces():
+
+# Plans the renames for a set of window events by recomputing only the
+# workspaces that each event's window was on before and after it.  When the
+# event is about a split container (e.g. one that was moved), that's every
+# window in it.  Falls back to a full pass when the workspaces themselves
+# changed, since that may require renumbering.
+def plan_renames_for_windows(tree, windows, icon_list_format='default'):
+    workspaces = list(workspaces_by_output(tree))
+    layout = [(workspace.id, output) for workspace, output in workspaces]
+    if layout != STATE.layout:
+        return plan_renames(tree, icon_list_format)
+
+    affected = set()
+    for window in windows:
+        con = tree.find_by_id(window.id)
+        leaves = (con or window).leaves()
+        for w in [window] + leaves:
+            old_ws_id = STATE.window_workspace.pop(w.window, None)
+            if old_ws_id is not None:
+                affected.add(old_ws_id)
+        if con is not None and con.workspace() is not None:
+            affected.add(con.workspace().id)
+
+    renames = [
+        plan_workspace_rename(workspace, STATE.nums[workspace.id],
+                              icon_list_format)
+        for workspace, _ in workspaces if workspace.id in affected
+    ]
+    return _ordered([r for r in renames if r is not None])
+
+
+# Records the results of the given renames, planned from 'tree'.
+def renamed(tree, renames, results):
+    METRICS.renamed(results)
+    if WORKSPACE_STATE is not None:
+        WORKSPACE_STATE.update(tree, renames, results)
+    if SHORTNAMES is not None:
+        SHORTNAMES.update(tree, renames, results)
+
+
+# renames all workspaces based on the windows present
+def rename_workspaces(i3, icon_list_format='default', tree=None):
+    if tree is None:
+        tree = i3tree.get_tree(i3)
+    renames = plan_renames(tree, icon_list_format)
+    renamed(tree, renames, batch_rename_workspaces(i3, renames))
+
+
+# Handles a window event by renaming only the workspaces it affected.
+def rename_workspaces_for_event(i3, e, icon_list_format='default'):
+    tree = i3tree.get_tree(i3)
+    renames = plan_renames_for_windows(tree, [e.container], icon_list_format)
+    renamed(tree, renames, batch_rename_workspaces(i3, renames))
+
+
+# Plans renaming workspaces to just numbers and shortnames, removing the icons.
+def plan_exit_renames(tree):
+    renames = []
+    for workspace in tree.workspaces():
         name_parts = parse_workspace_name(workspace.name)
         new_name = construct_workspace_name(
             NameParts(num=name_parts.num,
@@ -185,13 +591,341 @@ def on_exit(i3):
                       icons=None))
         if workspace.name == new_name:
             continue
-        i3.command('rename workspace "%s" to "%s"' %
-                   (workspace.name, new_name))
+        renames.append((workspace.name, new_name))
+    return _ordered(renames)
+
+
+# Rename workspaces to just numbers and shortnames, removing the icons.
+def on_exit(i3):
+    METRICS.renamed(
+        batch_rename_workspaces(i3, plan_exit_renames(i3tree.get_tree(i3))))
     i3.main_quit()
     sys.exit(0)
 
 
+# Handles one window, workspace::move or tick event the way the main loop does:
+# keeps the window class cache up to date and renames the workspaces the event
+# affected (or all of them, if 'incremental' is false).
+def handle_event(i3, e, icon_list_format='default', incremental=True):
+    if isinstance(e, i3ipc.TickEvent):
+        if is_reload_icons_tick(e):
+            swap_icons()
+            rename_workspaces(i3, icon_list_format=icon_list_format)
+        return
+    if isinstance(e, i3ipc.WorkspaceEvent):
+        # a workspace moved to another output
+        rename_workspaces(i3, icon_list_format=icon_list_format)
+        return
+    if e.change == 'new':
+        WINDOW_CLASSES.add(e.container)
+    elif e.change == 'close':
+        WINDOW_CLASSES.drop(e.container.window)
+    if handles_window_change(e.change):
+        if incremental:
+            rename_workspaces_for_event(i3, e, icon_list_format)
+        else:
+            rename_workspaces(i3, icon_list_format=icon_list_format)
+
+
+# Plans a full pass over a tree that may have changed while nothing was
+# listening (at startup and after i3 restarts).  X window ids survive an i3
+# restart, so the window class cache is kept, minus windows that are gone.
+# Given a shortname_store.ShortnameStore (on the first pass after the script
+# starts), its shortnames are restored in the same pass, so that they go out in
+# the same batched command as the icons.
+def plan_reconcile(tree, icon_list_format='default', shortnames=None):
+    WINDOW_CLASSES.retain(w.window for w in tree.leaves() if w.window)
+    return plan_renames(tree, icon_list_format, shortnames)
+
+
+# Yields how long to wait before each attempt to reach i3: nothing at first if
+# 'immediate', then 'delay' seconds doubling up to 'max_delay', for up to
+# 'timeout' seconds in total.  Right after a restart i3 may still be accepting
+# connections on its old socket, so reconnects shouldn't be immediate.
+def backoff(delay=0.05, max_delay=1.0, timeout=30.0, immediate=True):
+    if immediate:
+        yield 0
+    waited = 0
+    while waited + delay <= timeout:
+        yield delay
+        waited += delay
+        delay = min(delay * 2, max_delay)
+
+
+# Calls connect() until it returns a connection, waiting according to
+# backoff() between attempts.  Returns None if i3 didn't come back.
+def connect_with_backoff(connect, timeout=30.0, immediate=True):
+    import time
+    for delay in backoff(timeout=timeout, immediate=immediate):
+        time.sleep(delay)
+        try:
+            return connect()
+        except (OSError, EOFError) as e:
+            logging.info('Waiting for i3: %s' % e)
+    return None
+
+
+# Keeps a util.WorkspaceIndex (or a workspace_state.WorkspaceState or
+# shortname_store.ShortnameStore) up to date from the events on an i3
+# connection.
+def watch_workspaces(i3, index):
+    i3.on('workspace', lambda i3, e: index.handle_workspace_event(e))
+    i3.on('output', lambda i3, e: index.handle_output_event(e))
+
+
+def dump_metrics(instances=()):
+    if not instances:
+        logging.info('metrics:\n%s' % METRICS.format())
+    for instance in instances:
+        with instance.active():
+            logging.info('metrics for %s:\n%s' %
+                         (instance.socket_path, METRICS.format()))
+
+
+# Collects events and hands them to an async handler in batches.  The first
+# event after a quiet period is handled right away.  Events that arrive while a
+# pass is running, or shortly after one, are held until no new event has
+# arrived for 'window' seconds, but never for longer than 'max_latency'
+# seconds, so that a burst of window events (e.g. a session restore opening
+# forty windows) costs one rename pass instead of forty.
+class EventCoalescer:
+    def __init__(self, handler, window=0.02, max_latency=0.1):
+        import asyncio
+        self.handler = handler
+        self.window = window
+        self.max_latency = max_latency
+        self._events = []
+        # time.monotonic() when the oldest of self._events arrived
+        self._first_arrival = None
+        self._wakeup = asyncio.Event()
+
+    def push(self, event):
+        import time
+        if not self._events:
+            self._first_arrival = time.monotonic()
+        self._events.append(event)
+        self._wakeup.set()
+
+    async def run(self):
+        import asyncio
+        import time
+        last_pass = float('-inf')
+        while True:
+            await self._wakeup.wait()
+            now = time.monotonic()
+            if now - last_pass < self.window:
+                # We're in the middle of a burst, wait for it to settle down,
+                # but not past 'max_latency' after its first held event.
+                deadline = self._first_arrival + self.max_latency
+                while True:
+                    self._wakeup.clear()
+                    timeout = min(self.window, deadline - time.monotonic())
+                    if timeout <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+            self._wakeup.clear()
+            events, self._events = self._events, []
+            try:
+                await self.handler(events)
+            except Exception:
+                # Drop the batch rather than stop handling the events after
+                # it.
+                logging.exception('Failed to handle %d events' % len(events))
+            last_pass = time.monotonic()
+
+
+# The metrics name of an event, e.g. 'window::new'.
+def _event_type(e):
+    if isinstance(e, i3ipc.TickEvent):
+        return 'tick'
+    kind = 'workspace' if isinstance(e, i3ipc.WorkspaceEvent) else 'window'
+    return '%s::%s' % (kind, e.change)
+
+
+# Runs the same event handling as the main loop below, but on an i3ipc.aio
+# connection, with bursts of events coalesced into a single rename pass.  Given
+# an Instance, this serves that instance's i3 with its state, and leaves signal
+# handling to run_instances().
+async def run_aio(icon_list_format='default',
+                  window=0.02,
+                  max_latency=0.1,
+                  index=None,
+                  instance=None):
+    import asyncio
+
+    import time
+    from i3ipc.aio import Connection
+
+    active = instance.active if instance is not None else contextlib.nullcontext
+    i3 = None
+    socket_path = instance.socket_path if instance is not None else None
+    exiting = False
+    # id(event) -> time.perf_counter() when it arrived
+    received = {}
+    # the stored shortnames, until they've been restored
+    restore = SHORTNAMES
+
+    async def rename(events):
+        try:
+            await rename_pass(events)
+        except (OSError, EOFError) as e:
+            # e.g. the events were queued when i3 restarted; the reconcile pass
+            # after reconnecting covers them
+            logging.info('Dropped %d events: %s' % (len(events), e))
+            for e in events:
+                received.pop(id(e), None)
+
+    async def rename_pass(events):
+        with active():
+            ipc = METRICS.ipc
+        tree = await i3tree.get_tree_async(i3)
+        with active():
+            swap_icons()
+            if any(
+                    isinstance(e, (i3ipc.WorkspaceEvent, i3ipc.TickEvent))
+                    for e in events):
+                # a workspace moved to another output, or the icons changed
+                renames = plan_renames(tree, icon_list_format)
+            else:
+                renames = plan_renames_for_windows(
+                    tree, [e.container for e in events], icon_list_format)
+        results = await batch_rename_workspaces_async(i3, renames)
+        with active():
+            renamed(tree, renames, results)
+            # The pass's round trips are shared by the events in the batch.
+            ipc = (METRICS.ipc - ipc) / len(events)
+            for e in events:
+                METRICS.observe(_event_type(e), received.pop(id(e)), ipc)
+
+    coalescer = EventCoalescer(rename, window, max_latency)
+
+    def push(e):
+        received[id(e)] = time.perf_counter()
+        coalescer.push(e)
+
+    def window_handler(i3, e):
+        start = time.perf_counter()
+        with active():
+            if e.change == 'new':
+                WINDOW_CLASSES.add(e.container)
+            elif e.change == 'close':
+                WINDOW_CLASSES.drop(e.container.window)
+            if handles_window_change(e.change):
+                push(e)
+            else:
+                METRICS.observe(_event_type(e), start)
+
+    async def exit_handler():
+        nonlocal exiting
+        exiting = True
+        if i3 is None:
+            # still waiting for i3
+            return
+        tree = await i3tree.get_tree_async(i3)
+        await batch_rename_workspaces_async(i3, plan_exit_renames(tree))
+        i3.main_quit()
+
+    def shutdown_handler(i3, e):
+        nonlocal exiting
+        # i3 is exiting for good on 'exit', it'll be back after 'restart'
+        exiting = e.change == 'exit'
+        i3.main_quit()
+
+    if instance is not None:
+        instance.quit = exit_handler
+    else:
+        # Exit gracefully when ctrl+c is pressed
+        loop = asyncio.get_running_loop()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            loop.add_signal_handler(
+                sig, lambda: asyncio.ensure_future(exit_handler()))
+        loop.add_signal_handler(signal.SIGUSR1, dump_metrics)
+
+    worker = asyncio.ensure_future(coalescer.run())
+    try:
+        while not exiting:
+            for delay in backoff(immediate=i3 is None):
+                await asyncio.sleep(delay)
+                if exiting:
+                    return
+                try:
+                    i3 = await Connection(socket_path).connect()
+                    break
+                except (OSError, EOFError) as e:
+                    logging.info('Waiting for i3: %s' % e)
+            else:
+                logging.error('Lost the connection to i3')
+                return
+            socket_path = i3.socket_path
+            with active():
+                METRICS.count_ipc(i3)
+
+            try:
+                tree = await i3tree.get_tree_async(i3)
+                with active():
+                    renames = plan_reconcile(tree, icon_list_format, restore)
+                results = await batch_rename_workspaces_async(i3, renames)
+                restore = None
+                with active():
+                    renamed(tree, renames, results)
+
+                i3.on('window', window_handler)
+                i3.on('workspace::move', lambda i3, e: push(e))
+                i3.on('shutdown', shutdown_handler)
+                if ICON_CONFIG is not None:
+                    i3.on('tick', lambda i3, e: push(e)
+                          if is_reload_icons_tick(e) else None)
+                if index is not None:
+                    index.invalidate()
+                    watch_workspaces(i3, index)
+                if WORKSPACE_STATE is not None:
+                    watch_workspaces(i3, WORKSPACE_STATE)
+                if SHORTNAMES is not None:
+                    watch_workspaces(i3, SHORTNAMES)
+                await i3.main()
+            except (OSError, EOFError) as e:
+                # e.g. we reached i3 just before it restarted
+                logging.info('Lost the connection to i3 at %s: %s' %
+                             (socket_path, e))
+            if not exiting:
+                with active():
+                    METRICS.reconnects += 1
+    finally:
+        worker.cancel()
+
+
+# Serves several i3 instances (e.g. one per seat, or nested Xephyr sessions)
+# from one process and one event loop: a run_aio() per Instance.  Each instance
+# costs its own caches and connections rather than a whole interpreter with its
+# own copy of the icon tables.  Returns once every instance's i3 has exited.
+async def run_instances(instances,
+                        icon_list_format='default',
+                        window=0.02,
+                        max_latency=0.1):
+    import asyncio
+
+    def quit_all():
+        for instance in instances:
+            if instance.quit is not None:
+                asyncio.ensure_future(instance.quit())
+
+    loop = asyncio.get_running_loop()
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        loop.add_signal_handler(sig, quit_all)
+    loop.add_signal_handler(signal.SIGUSR1, lambda: dump_metrics(instances))
+
+    await asyncio.gather(*(run_aio(icon_list_format,
+                                   window,
+                                   max_latency,
+                                   instance=instance)
+                           for instance in instances))
+
+
 if __name__ == '__main__':
+    import argparse
     parser = argparse.ArgumentParser(
         description=
         "Rename workspaces dynamically to show icons for running programs.")
@@ -204,34 +938,227 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         '--icon_list_format',
-        type=str,
+        type=icon_list_formatter,
         default='default',
         help="The formatting of the list of icons."
         "Accepted values:"
         "    - default: no formatting,"
         "    - mathematician: factorize with superscripts (e.g. aababa -> a⁴b²),"
-        "    - chemist: factorize with subscripts (e.g. aababa -> a₄b₂).")
+        "    - chemist: factorize with subscripts (e.g. aababa -> a₄b₂),"
+        "    - dedup: show each icon once (e.g. aababa -> ab),"
+        "    - cap:N: show at most N icons (e.g. with cap:3, aababa -> aab+3),"
+        "    - dedup:N: both (e.g. with dedup:1, aababa -> a+1).")
+    parser.add_argument(
+        '--icon_config',
+        metavar='PATH',
+        help=
+        "A JSON file with more icons, which is reloaded when it changes (see icon_rules.load_config())."
+    )
+    parser.add_argument(
+        '--noincremental',
+        action='store_true',
+        default=False,
+        help=
+        "Rename all workspaces on every window event instead of only the ones the event affected."
+    )
+    parser.add_argument(
+        '--aio',
+        action='store_true',
+        default=False,
+        help=
+        "Handle events on an asyncio event loop, coalescing bursts of events into a single rename pass."
+    )
+    parser.add_argument(
+        '--coalesce_ms',
+        type=float,
+        default=20,
+        help=
+        "With --aio, how long to wait for a burst of events to settle before renaming."
+    )
+    parser.add_argument(
+        '--max_latency_ms',
+        type=float,
+        default=100,
+        help="With --aio, the longest an event is held back while coalescing."
+    )
+    parser.add_argument(
+        '--i3_socket',
+        action='append',
+        metavar='PATH[=DISPLAY]',
+        help=
+        "Serve the i3 instance listening on this IPC socket. Repeat to serve several from one process, on one event loop (implies --aio). Add =DISPLAY (e.g. =:1) for the X display to look up window classes on when i3 doesn't report them, if it isn't $DISPLAY."
+    )
+    parser.add_argument(
+        '--control_socket',
+        nargs='?',
+        const='',
+        default=None,
+        help=
+        "Also serve new_workspace and rename_workspace requests on a unix socket (see control.py). Defaults to $XDG_RUNTIME_DIR/i3scripts.sock."
+    )
+    parser.add_argument(
+        '--state_socket',
+        nargs='?',
+        const='',
+        default=None,
+        help=
+        "Stream the workspaces (numbers, shortnames, icons, focus and urgency) to status bars as JSON lines on a unix socket (see workspace_state.py). Defaults to $XDG_RUNTIME_DIR/i3scripts-state.sock."
+    )
+    parser.add_argument(
+        '--shortnames',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='STORE',
+        help=
+        "Remember the shortnames of workspaces in a JSON file and give them back to workspaces without one at startup (see shortname_store.py). Defaults to $XDG_STATE_HOME/i3scripts/shortnames.json."
+    )
+    parser.add_argument(
+        '--record',
+        metavar='TRACE',
+        help=
+        "Record the events and i3 replies this script sees to a trace file, to replay later with i3trace.py."
+    )
     args = parser.parse_args()
+    if args.record and args.aio:
+        parser.error('--record is not supported with --aio')
+    if args.i3_socket and (args.control_socket is not None
+                           or args.state_socket is not None
+                           or args.shortnames is not None or args.record):
+        parser.error('--control_socket, --state_socket, --shortnames and '
+                     '--record are not supported with --i3_socket')
 
     RENUMBER_WORKSPACES = not args.norenumber_workspaces
 
     logging.basicConfig(level=logging.INFO)
 
-    ensure_window_icons_lowercase()
+    ICON_CONFIG = args.icon_config
+    try:
+        compile_window_icons()
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
 
-    i3 = i3ipc.Connection()
+    if args.i3_socket:
+        import asyncio
+        instances = [Instance.parse(arg) for arg in args.i3_socket]
+        if ICON_CONFIG is not None:
+            watch_icon_config([instance.socket_path for instance in instances])
+        asyncio.run(
+            run_instances(instances,
+                          icon_list_format=args.icon_list_format,
+                          window=args.coalesce_ms / 1000,
+                          max_latency=args.max_latency_ms / 1000))
+        sys.exit(0)
+
+    index = None
+    if args.control_socket is not None:
+        import control
+        # A separate connection, so that requests aren't queued behind a
+        # rename pass.
+        control_i3 = i3ipc.Connection(auto_reconnect=True)
+        index = WorkspaceIndex(control_i3)
+        control.start_server(control_i3, args.control_socket or None, index,
+                             METRICS.as_dict)
+    if args.state_socket is not None:
+        import workspace_state
+        WORKSPACE_STATE = workspace_state.WorkspaceState()
+        workspace_state.start_server(WORKSPACE_STATE, args.state_socket
+                                     or None)
+    if args.shortnames is not None:
+        import shortname_store
+        SHORTNAMES = shortname_store.ShortnameStore(args.shortnames or None)
+    METRICS.start_sampling()
+    if ICON_CONFIG is not None:
+        watch_icon_config()
+
+    if args.aio:
+        import asyncio
+        asyncio.run(
+            run_aio(icon_list_format=args.icon_list_format,
+                    window=args.coalesce_ms / 1000,
+                    max_latency=args.max_latency_ms / 1000,
+                    index=index))
+        sys.exit(0)
+
+    import time
+
+    recorder = None
+    if args.record:
+        import atexit
+        import i3trace
+        recorder = i3trace.Recorder(args.record)
+        atexit.register(recorder.close)
 
     # Exit gracefully when ctrl+c is pressed
-    for sig in [signal.SIGINT, signal.SIGTERM]:
-        signal.signal(sig, lambda signal, frame: on_exit(i3))
+    i3 = None
 
-    rename_workspaces(i3, icon_list_format=args.icon_list_format)
+    def exit_handler(signal, frame):
+        global exiting
+        # i3ipc's main() swallows the SystemExit raised by on_exit() and just
+        # returns, so the loop below needs to know not to reconnect.
+        exiting = True
+        if i3 is None:
+            sys.exit(0)
+        on_exit(i3)
 
-    # Call rename_workspaces() for relevant window events
+    for sig in [signal.SIGINT, signal.SIGTERM]:
+        signal.signal(sig, exit_handler)
+    signal.signal(signal.SIGUSR1, lambda signal, frame: dump_metrics())
+
+    # Rename workspaces for relevant window events
     def event_handler(i3, e):
-        if e.change in ['new', 'close', 'move']:
-            rename_workspaces(i3, icon_list_format=args.icon_list_format)
+        start, ipc = time.perf_counter(), METRICS.ipc
+        if recorder is not None:
+            recorder.event(_event_type(e), e.ipc_data)
+        handle_event(i3, e, args.icon_list_format, not args.noincremental)
+        METRICS.observe(_event_type(e), start, METRICS.ipc - ipc)
+
+    def shutdown_handler(i3, e):
+        global exiting
+        # i3 is exiting for good on 'exit', it'll be back after 'restart'
+        exiting = e.change == 'exit'
+        i3.main_quit()
+
+    # When i3 restarts (or the connection is lost) reconnect and catch up with
+    # one full pass, keeping the window class cache.
+    exiting = False
+    socket_path = None
+    # the stored shortnames, until they've been restored
+    restore = SHORTNAMES
+    while not exiting:
+        i3 = connect_with_backoff(lambda: i3ipc.Connection(socket_path),
+                                  immediate=i3 is None)
+        if i3 is None:
+            logging.error('Lost the connection to i3')
+            sys.exit(1)
+        socket_path = i3.socket_path
+        METRICS.count_ipc(i3)
+        if recorder is not None:
+            recorder.wrap(i3)
+
+        i3.on('window', event_handler)
+        i3.on('workspace::move', event_handler)
+        i3.on('shutdown', shutdown_handler)
+        if ICON_CONFIG is not None:
+            i3.on('tick', lambda i3, e: event_handler(i3, e)
+                  if is_reload_icons_tick(e) else None)
+        if index is not None:
+            index.invalidate()
+            watch_workspaces(i3, index)
+        if WORKSPACE_STATE is not None:
+            watch_workspaces(i3, WORKSPACE_STATE)
+        if SHORTNAMES is not None:
+            watch_workspaces(i3, SHORTNAMES)
 
-    i3.on('window', event_handler)
-    i3.on('workspace::move', event_handler)
-    i3.main()
+        try:
+            tree = i3tree.get_tree(i3)
+            renames = plan_reconcile(tree, args.icon_list_format, restore)
+            results = batch_rename_workspaces(i3, renames)
+            restore = None
+            renamed(tree, renames, results)
+            i3.main()
+        except OSError as e:
+            # e.g. we reached i3 just before it restarted
+            logging.info('Lost the connection to i3: %s' % e)
+        if not exiting:
+            METRICS.reconnects += 1
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+#
+# github.com/justbuchanan/i3scripts
+#
+# Benchmarks for the scripts in this repo, run against the fake i3 in
+# fake_i3.py so that no running window manager is needed.  Each benchmark is
+# run on synthetic layouts of increasing size (outputs x workspaces per output
+# x windows per workspace) and reports the median latency along with the number
+# of i3 ipc messages and subprocesses each call costs, so that scaling
+# regressions show up as numbers.
+#
+# Usage:
+#   ./benchmark.py
+#   ./benchmark.py --sizes 1x4x2,4x16x16 --repeat 20 --json results.json
+#
+# Dependencies:
+# * i3ipc       - install with pip
+# * fontawesome - install with pip
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import i3ipc
+
+import autoname_workspaces
+import fake_i3
+import i3splat
+import util
+from new_workspace import find_next_ws_num_on_monitor
+
+DEFAULT_SIZES = [(1, 4, 2), (2, 8, 4), (3, 12, 8), (4, 16, 16)]
+
+# Count every subprocess started by this interpreter.
+_subprocess_count = 0
+
+
+def _audit(event, args):
+    global _subprocess_count
+    if event == 'subprocess.Popen':
+        _subprocess_count += 1
+
+
+sys.addaudithook(_audit)
+
+
+class Result:
+    def __init__(self, name, size, times, ipc, subprocesses):
+        self.name = name
+        self.size = size
+        self.times = times
+        self.ipc = ipc
+        self.subprocesses = subprocesses
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'outputs': self.size[0],
+            'workspaces': self.size[1],
+            'windows': self.size[2],
+            'median_ms': statistics.median(self.times) * 1000,
+            'min_ms': min(self.times) * 1000,
+            'ipc_messages': self.ipc,
+            'subprocesses': self.subprocesses,
+        }
+
+
+# Runs 'fn' 'repeat' times against the given server, calling 'setup' before
+# each run (untimed).  IPC messages and subprocesses are averaged per run.
+def measure(name, size, server, fn, repeat, setup=None):
+    times = []
+    ipc = 0
+    subprocesses = 0
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        server.i3.reset_counts()
+        before = _subprocess_count
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+        subprocesses += _subprocess_count - before
+        ipc += sum(server.i3.message_counts.values())
+    return Result(name, size, times, ipc / repeat, subprocesses / repeat)
+
+
+def _reset_autoname():
+    autoname_workspaces.STATE = autoname_workspaces.RenameState()
+    autoname_workspaces.WINDOW_CLASSES = autoname_workspaces.WindowClassCache()
+
+
+def bench_rename_workspaces(server, size, repeat):
+    results = []
+    i3 = i3ipc.Connection(server.socket_path)
+
+    def fresh_desktop():
+        server.i3 = fake_i3.FakeI3.synthetic(*size)
+        _reset_autoname()
+
+    results.append(
+        measure('rename_workspaces (cold)', size, server,
+                lambda _: autoname_workspaces.rename_workspaces(i3), repeat,
+                fresh_desktop))
+    results.append(
+        measure('rename_workspaces (steady)', size, server,
+                lambda _: autoname_workspaces.rename_workspaces(i3), repeat))
+
+    # A single new window, handled incrementally.
+    def open_window():
+        window = server.i3.open_window('Slack')
+        _, con = server.i3.find_window(window)
+        return i3ipc.WindowEvent({'change': 'new', 'container': con}, i3)
+
+    def handle_event(e):
+        autoname_workspaces.WINDOW_CLASSES.add(e.container)
+        autoname_workspaces.rename_workspaces_for_event(i3, e)
+
+    results.append(
+        measure('window::new event', size, server, handle_event, repeat,
+                open_window))
+    return results
+
+
+def bench_find_next_ws_num(server, size, repeat):
+    server.i3 = fake_i3.FakeI3.synthetic(*size)
+    i3 = i3ipc.Connection(server.socket_path)
+    return [
+        measure('find_next_ws_num_on_monitor', size, server,
+                lambda _: find_next_ws_num_on_monitor(i3), repeat)
+    ]
+
+
+def bench_launch(server, size, repeat):
+    apps = size[2]
+
+    # Each app "starts" by opening its window in the fake i3, from a thread so
+    # that the launcher is already waiting for it.
+    def app(xclass):
+        def command():
+            import threading
+            threading.Thread(target=server.i3.open_window,
+                             args=(xclass, )).start()
+
+        return i3splat.App(xClass=xclass, command=command)
+
+    def workspace(xclasses):
+        def make():
+            server.i3 = fake_i3.FakeI3.synthetic(*size)
+            return i3splat.Workspace('bench', [(1 / apps, app(xclass))
+                                               for xclass in xclasses])
+
+        return make
+
+    distinct = ['Bench%d' % i for i in range(apps)]
+    same = ['Bench'] * apps
+    return [
+        measure('Workspace.launch (distinct)', size, server,
+                lambda ws: ws.launch(), repeat, workspace(distinct)),
+        measure('Workspace.launch (same class)', size, server,
+                lambda ws: ws.launch(), repeat, workspace(same)),
+    ]
+
+
+# Compares the xprop backends in util on a cold desktop.  This needs a real X
+# server, so it starts an Xvfb (if installed) and creates windows on it.
+def bench_xprop(server, size, repeat):
+    from Xlib import X, display
+
+    if not shutil.which('Xvfb'):
+        logging.warning('Xvfb is not installed, skipping xprop benchmarks')
+        return []
+
+    display_name = ':%d' % (90 + os.getpid() % 9)
+    xvfb = subprocess.Popen(['Xvfb', display_name, '-nolisten', 'tcp'],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            if os.path.exists('/tmp/.X11-unix/X' + display_name[1:]):
+                break
+            time.sleep(0.05)
+        d = display.Display(display_name)
+        root = d.screen().root
+        classes = [fake_i3.SYNTHETIC_CLASSES[i % len(fake_i3.SYNTHETIC_CLASSES)]
+                   for i in range(size[0] * size[1] * size[2])]
+        win_ids = []
+        for xclass, instance in classes:
+            w = root.create_window(0, 0, 10, 10, 0, X.CopyFromParent)
+            w.set_wm_class(instance, xclass)
+            win_ids.append(w.id)
+        d.sync()
+
+        results = []
+        if shutil.which('xprop'):
+            env_display = os.environ.get('DISPLAY')
+            os.environ['DISPLAY'] = display_name
+            backend = util.SubprocessXprop()
+            results.append(
+                measure('xprop WM_CLASS (subprocess)', size, server,
+                        lambda _: backend.get_many(win_ids, 'WM_CLASS'),
+                        repeat))
+            if env_display is None:
+                del os.environ['DISPLAY']
+            else:
+                os.environ['DISPLAY'] = env_display
+
+        backend = util.XlibXprop(display_name)
+        results.append(
+            measure('xprop WM_CLASS (xlib)', size, server,
+                    lambda _: backend.get_many(win_ids, 'WM_CLASS'), repeat))
+        return results
+    finally:
+        xvfb.terminate()
+        xvfb.wait()
+
+
+BENCHMARKS = [
+    bench_rename_workspaces, bench_find_next_ws_num, bench_launch, bench_xprop
+]
+
+
+def _parse_sizes(text):
+    return [tuple(int(n) for n in size.split('x')) for size in text.split(',')]
+
+
+def print_results(results):
+    header = '%-30s %12s %8s %10s %8s %8s' % ('benchmark', 'size', 'windows',
+                                              'median ms', 'ipc', 'procs')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        d = r.as_dict()
+        print('%-30s %12s %8d %10.3f %8.1f %8.1f' %
+              (r.name, '%dx%dx%d' % r.size, r.size[0] * r.size[1] * r.size[2],
+               d['median_ms'], r.ipc, r.subprocesses))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the i3 scripts against a fake i3.")
+    parser.add_argument(
+        '--sizes',
+        type=_parse_sizes,
+        default=DEFAULT_SIZES,
+        help=
+        "Comma-separated layout sizes, each as OUTPUTSxWORKSPACESxWINDOWS (per output and per workspace)."
+    )
+    parser.add_argument('--repeat',
+                        type=int,
+                        default=10,
+                        help="Number of runs per benchmark and size.")
+    parser.add_argument('--filter',
+                        default='',
+                        help="Only run benchmarks whose name contains this.")
+    parser.add_argument('--json', help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # i3splat runs i3-msg, point it at the fake instead.
+        shim = os.path.join(tmp, 'i3-msg')
+        with open(shim, 'w') as f:
+            f.write('#!/bin/sh\nexec "%s" "%s" msg "$@"\n' %
+                    (sys.executable, os.path.abspath(fake_i3.__file__)))
+        os.chmod(shim, 0o755)
+        os.environ['PATH'] = tmp + os.pathsep + os.environ['PATH']
+
+        socket_path = os.path.join(tmp, 'i3.sock')
+        os.environ['I3SOCK'] = socket_path
+
+        results = []
+        with fake_i3.FakeI3Server(socket_path) as server:
+            for bench in BENCHMARKS:
+                if args.filter not in bench.__name__:
+                    continue
+                for size in args.sizes:
+                    results += bench(server, size, args.repeat)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([r.as_dict() for r in results], f, indent=2)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# github.com/justbuchanan/i3scripts
+#
+# Lets a long-running process (autoname_workspaces.py started with
+# --control_socket) run the new_workspace and rename_workspace scripts on
+# request, over a unix socket.  Each key press then costs a single socket write
+# instead of starting a new python interpreter, importing everything and
+# connecting to i3.
+#
+# The protocol is one command per line, answered with "ok" or "error: ...":
+#
+#   new_workspace
+#   new_workspace move_focused
+#   rename_workspace <shortname>     (a single word of letters, digits and '_')
+#   rename_workspace                 (shows the zenity dialog)
+#   stats                            (answered with one line of JSON instead)
+#
+# When run as a script, this is the client:
+#
+#   bindsym $mod+n exec ~/.config/i3/i3scripts/control.py new_workspace
+#   bindsym $mod+Shift+n exec ~/.config/i3/i3scripts/control.py new_workspace move_focused
+#   bindsym $mod+r exec ~/.config/i3/i3scripts/control.py rename_workspace
+#
+# or, without starting python at all:
+#
+#   bindsym $mod+n exec echo new_workspace | socat - UNIX-CONNECT:$XDG_RUNTIME_DIR/i3scripts.sock
+
+import os
+import socket
+import sys
+
+
+# $I3SCRIPTS_SOCK, or a socket in the user's runtime directory.
+def default_socket_path():
+    if os.environ.get('I3SCRIPTS_SOCK'):
+        return os.environ['I3SCRIPTS_SOCK']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'i3scripts.sock')
+    return '/tmp/i3scripts-%d.sock' % os.getuid()
+
+
+# Runs a single command line against the given i3 connection, reading workspace
+# state from the given util.WorkspaceIndex if there is one.  'stats' is a
+# function returning a JSON-serializable dict for the stats command.  Returns
+# the reply line.
+def run_command(i3, line, index=None, stats=None):
+    from new_workspace import new_workspace
+    from rename_workspace import rename_workspace
+
+    parts = line.split(None, 1)
+    if not parts:
+        return 'error: empty command'
+    command, arg = parts[0], parts[1].strip() if len(parts) > 1 else None
+
+    try:
+        if command == 'new_workspace':
+            if arg not in [None, 'move_focused']:
+                return 'error: unknown argument: %s' % arg
+            new_workspace(move_focused=arg == 'move_focused',
+                          i3=i3,
+                          index=index)
+        elif command == 'rename_workspace':
+            rename_workspace(arg, i3=i3, index=index)
+        elif command == 'ping':
+            pass
+        elif command == 'stats' and stats is not None:
+            import json
+            return json.dumps(stats(), separators=(',', ':'))
+        else:
+            return 'error: unknown command: %s' % command
+    except SystemExit:
+        # e.g. the user cancelled the rename dialog
+        return 'error: cancelled'
+    except Exception as e:
+        return 'error: %s' % e
+    return 'ok'
+
+
+# Starts serving commands on a unix socket from a background thread, using the
+# given (synchronous) i3 connection and optional util.WorkspaceIndex and stats
+# function (see run_command()).  Returns the server; call shutdown() and
+# server_close() on it to stop.
+def start_server(i3, socket_path=None, index=None, stats=None):
+    import logging
+    import socketserver
+
+    socket_path = socket_path or default_socket_path()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                line = line.decode('utf-8').strip()
+                if not line:
+                    continue
+                reply = run_command(i3, line, index, stats)
+                logging.info("control: '%s' -> %s" % (line, reply[:80]))
+                self.wfile.write((reply + '\n').encode('utf-8'))
+
+    server = serve_unix_socket(socket_path, Handler)
+    logging.info('Listening for commands on %s' % socket_path)
+    return server
+
+
+# Serves connections on a unix socket that only this user can connect to, one
+# thread per connection, from a background thread.  'handler' is a
+# socketserver.BaseRequestHandler subclass.  Returns the server.
+def serve_unix_socket(socket_path, handler):
+    import socketserver
+    import threading
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, handler)
+    finally:
+        os.umask(old_umask)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Sends one command line to the server and returns its reply.
+def send_command(line, socket_path=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall(line.encode('utf-8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        reply = b''
+        while not reply.endswith(b'\n'):
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    return reply.decode('utf-8').strip()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('usage: %s <command> [argument]' % sys.argv[0])
+    reply = send_command(' '.join(sys.argv[1:]))
+    if reply.startswith('error'):
+        sys.exit(reply)
+    if reply != 'ok':
+        print(reply)
@@ -0,0 +1,773 @@
+#!/usr/bin/env python3
+#
+# github.com/justbuchanan/i3scripts
+#
+# A stand-in for i3 that speaks enough of the IPC protocol to run the scripts in
+# this repo without a live window manager.  It serves an in-memory layout tree
+# on a unix socket and supports get_tree, get_workspaces, get_outputs,
+# get_version, send_tick, subscribing to events, and the handful of commands
+# the scripts send (workspace, rename workspace, move window to workspace,
+# append_layout).
+# Opening and closing windows on the fake emits the same window/workspace events
+# that i3 would.
+#
+# It's used by benchmark.py, but can also be run on its own and pointed at by
+# any of the scripts through the I3SOCK environment variable:
+#
+#   ./fake_i3.py serve --socket /tmp/fake-i3.sock --outputs 2 --workspaces 4 \
+#       --windows 3 &
+#   I3SOCK=/tmp/fake-i3.sock ./autoname_workspaces.py
+#
+# The "msg" subcommand is a tiny replacement for i3-msg that sends a command to
+# the socket in $I3SOCK.
+#
+# Only the standard library is used here so that it starts quickly when used as
+# an i3-msg replacement.
+
+import argparse
+import itertools
+import json
+import os
+import re
+import shlex
+import socket
+import socketserver
+import struct
+import sys
+import threading
+from collections import Counter
+
+_MAGIC = b'i3-ipc'
+_HEADER = '=%dsII' % len(_MAGIC)
+_HEADER_SIZE = struct.calcsize(_HEADER)
+
+# message types
+RUN_COMMAND = 0
+GET_WORKSPACES = 1
+SUBSCRIBE = 2
+GET_OUTPUTS = 3
+GET_TREE = 4
+GET_MARKS = 5
+GET_BAR_CONFIG = 6
+GET_VERSION = 7
+SEND_TICK = 10
+
+MESSAGE_NAMES = {
+    RUN_COMMAND: 'command',
+    GET_WORKSPACES: 'get_workspaces',
+    SUBSCRIBE: 'subscribe',
+    GET_OUTPUTS: 'get_outputs',
+    GET_TREE: 'get_tree',
+    GET_MARKS: 'get_marks',
+    GET_BAR_CONFIG: 'get_bar_config',
+    GET_VERSION: 'get_version',
+    SEND_TICK: 'send_tick',
+}
+
+# Event types are sent with the highest bit set.
+EVENT_TYPES = {
+    'workspace': 0,
+    'output': 1,
+    'mode': 2,
+    'window': 3,
+    'barconfig_update': 4,
+    'binding': 5,
+    'shutdown': 6,
+    'tick': 7,
+}
+
+# (class, instance) pairs used for synthetic windows.  Most of them have an
+# icon in autoname_workspaces.py, a couple don't.
+SYNTHETIC_CLASSES = [
+    ('Firefox', 'Navigator'),
+    ('URxvt', 'urxvt'),
+    ('Google-chrome', 'google-chrome'),
+    ('Slack', 'slack'),
+    ('Emacs', 'emacs'),
+    ('Spotify', 'spotify'),
+    ('Evince', 'evince'),
+    ('kitty', 'kitty'),
+    ('Unknown-app', 'unknown-app'),
+    ('Gimp-2.8', 'gimp-2.8'),
+]
+
+
+def pack(msg_type, payload):
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    return struct.pack(_HEADER, _MAGIC, len(payload), msg_type) + payload
+
+
+def _recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+# Reads one message from the socket.  Returns (msg_type, payload bytes), or
+# None at EOF.
+def recv_message(sock):
+    header = _recv_exactly(sock, _HEADER_SIZE)
+    if header is None:
+        return None
+    magic, length, msg_type = struct.unpack(_HEADER, header)
+    if magic != _MAGIC:
+        raise ValueError('Bad i3 ipc magic: %r' % magic)
+    payload = _recv_exactly(sock, length) if length else b''
+    if payload is None:
+        return None
+    return msg_type, payload
+
+
+def _rect(x=0, y=0, width=0, height=0):
+    return {'x': x, 'y': y, 'width': width, 'height': height}
+
+
+# Splits a command string on the ';' and ',' separators that are not inside
+# quotes.
+def split_commands(payload):
+    commands = []
+    current = ''
+    quoted = False
+    escaped = False
+    for c in payload:
+        if escaped:
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c == '"':
+            quoted = not quoted
+        elif c in ';,' and not quoted:
+            commands.append(current.strip())
+            current = ''
+            continue
+        current += c
+    commands.append(current.strip())
+    return [c for c in commands if c]
+
+
+def _workspace_num(name):
+    m = re.match(r'\d+', name)
+    return int(m.group()) if m else -1
+
+
+# The window manager side: an in-memory layout tree plus the command and query
+# handlers that operate on it.  All public methods are safe to call from any
+# thread.
+class FakeI3:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ids = itertools.count(94000000000000, 16)
+        self._window_ids = itertools.count(0x1a00001, 0x200000)
+        self._subscribers = []
+        self.message_counts = Counter()
+        self.commands = []
+        self.tree = self._node('root', 'root', rect=_rect(0, 0, 1920, 1080))
+        self.tree['nodes'].append(self._output('__i3', 0))
+        self.tree['nodes'][0]['nodes'][0]['nodes'].append(
+            self._node('__i3_scratch', 'workspace', num=-1))
+        self.focused_workspace = None
+
+    # Builds a fake with 'outputs' monitors, each with 'workspaces' workspaces
+    # holding 'windows' windows.
+    @classmethod
+    def synthetic(cls, outputs=1, workspaces=1, windows=1):
+        i3 = cls()
+        n = 1
+        classes = itertools.cycle(SYNTHETIC_CLASSES)
+        for o in range(outputs):
+            output = i3.add_output('DP-%d' % (o + 1))
+            for w in range(workspaces):
+                workspace = i3._add_workspace(output, str(n))
+                for k in range(windows):
+                    i3._add_window(workspace, *next(classes))
+                n += 1
+            # leave a gap between monitors like autoname_workspaces does
+            n += 1
+        first = i3.workspaces()[0]
+        i3._focus(first)
+        return i3
+
+    def reset_counts(self):
+        with self._lock:
+            self.message_counts.clear()
+            self.commands.clear()
+
+    # Tree construction
+    ############################################################################
+
+    def _node(self, name, type, **kwargs):
+        node = {
+            'id': next(self._ids),
+            'type': type,
+            'orientation': 'none',
+            'scratchpad_state': 'none',
+            'percent': None,
+            'urgent': False,
+            'marks': [],
+            'focused': False,
+            'output': None,
+            'layout': 'splith',
+            'workspace_layout': 'default',
+            'last_split_layout': 'splith',
+            'border': 'normal',
+            'current_border_width': -1,
+            'rect': _rect(),
+            'deco_rect': _rect(),
+            'window_rect': _rect(),
+            'geometry': _rect(),
+            'name': name,
+            'window': None,
+            'window_type': None,
+            'nodes': [],
+            'floating_nodes': [],
+            'focus': [],
+            'fullscreen_mode': 0,
+            'sticky': False,
+            'floating': 'auto_off',
+            'swallows': [],
+        }
+        node.update(kwargs)
+        return node
+
+    def _output(self, name, index):
+        output = self._node(name,
+                            'output',
+                            layout='output',
+                            rect=_rect(index * 1920, 0, 1920, 1080))
+        output['nodes'].append(
+            self._node('content', 'con', output=name, rect=output['rect']))
+        return output
+
+    def add_output(self, name):
+        with self._lock:
+            output = self._output(name, len(self.tree['nodes']) - 1)
+            self.tree['nodes'].append(output)
+            return output
+
+    def _add_workspace(self, output, name):
+        content = output['nodes'][0]
+        workspace = self._node(name,
+                               'workspace',
+                               num=_workspace_num(name),
+                               output=output['name'],
+                               rect=content['rect'])
+        content['nodes'].append(workspace)
+        self._sort_workspaces(content)
+        return workspace
+
+    def _add_window(self, workspace, xclass, instance, title=None):
+        window = next(self._window_ids)
+        title = title or '%s %x' % (xclass, window)
+        con = self._node(title,
+                         'con',
+                         output=workspace['output'],
+                         window=window,
+                         window_type='normal',
+                         border='pixel',
+                         window_properties={
+                             'class': xclass,
+                             'instance': instance,
+                             'title': title,
+                             'transient_for': None,
+                         })
+        workspace['nodes'].append(con)
+        workspace['focus'].insert(0, con['id'])
+        return con
+
+    def _sort_workspaces(self, content):
+        # i3 keeps numbered workspaces sorted, with named ones after them
+        content['nodes'].sort(key=lambda ws: (ws['num'] < 0, ws['num']))
+
+    # Tree queries
+    ############################################################################
+
+    def outputs(self):
+        return [o for o in self.tree['nodes'] if not o['name'].startswith('__')]
+
+    def workspaces(self, output=None):
+        return [
+            ws for o in self.outputs() if output is None or o is output
+            for ws in o['nodes'][0]['nodes']
+        ]
+
+    def _workspace_by(self, key, value):
+        for ws in self.workspaces():
+            if ws[key] == value:
+                return ws
+        return None
+
+    def _output_of(self, workspace):
+        for o in self.outputs():
+            if workspace in o['nodes'][0]['nodes']:
+                return o
+        return None
+
+    # Returns all windows (and placeholders) under a node.
+    def leaves(self, node):
+        if not node['nodes'] and not node['floating_nodes']:
+            return [node] if node['type'] == 'con' else []
+        return [
+            leaf for child in node['nodes'] + node['floating_nodes']
+            for leaf in self.leaves(child)
+        ]
+
+    def find_window(self, window):
+        for ws in self.workspaces():
+            for leaf in self.leaves(ws):
+                if leaf['window'] == window:
+                    return ws, leaf
+        return None, None
+
+    def get_workspaces(self):
+        return [{
+            'id': ws['id'],
+            'num': ws['num'],
+            'name': ws['name'],
+            'visible': ws is self.focused_workspace,
+            'focused': ws is self.focused_workspace,
+            'urgent': ws['urgent'],
+            'rect': ws['rect'],
+            'output': ws['output'],
+        } for ws in self.workspaces()]
+
+    def get_outputs(self):
+        visible = {ws['output']: ws['name'] for ws in self.workspaces()}
+        return [{
+            'name': o['name'],
+            'active': True,
+            'primary': i == 0,
+            'current_workspace': visible.get(o['name']),
+            'rect': o['rect'],
+        } for i, o in enumerate(self.outputs())]
+
+    # Events
+    ############################################################################
+
+    def subscribe(self, client, events):
+        with self._lock:
+            self._subscribers.append((client, set(events)))
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers = [(c, e) for c, e in self._subscribers
+                                 if c is not client]
+
+    def emit(self, event, payload):
+        data = pack((1 << 31) | EVENT_TYPES[event], json.dumps(payload))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client, events in subscribers:
+            if event in events:
+                client.send_raw(data)
+
+    def _workspace_event(self, change, current, old=None):
+        self.emit('workspace', {
+            'change': change,
+            'current': current,
+            'old': old
+        })
+
+    def _window_event(self, change, con):
+        self.emit('window', {'change': change, 'container': con})
+
+    # Simulated user actions
+    ############################################################################
+
+    def _focus(self, workspace):
+        old = self.focused_workspace
+        if old is workspace:
+            return
+        if old is not None:
+            old['focused'] = False
+        workspace['focused'] = True
+        self.focused_workspace = workspace
+        self._workspace_event('focus', workspace, old)
+        if old is not None and not self.leaves(old):
+            # i3 removes empty workspaces when they lose focus
+            content = self._output_of(old)['nodes'][0]
+            content['nodes'].remove(old)
+            self._workspace_event('empty', old)
+
+    # Opens a window on the given workspace (the focused one by default),
+    # filling a matching placeholder left by append_layout if there is one.
+    # Returns the new X window id.
+    def open_window(self, xclass, instance=None, workspace=None, title=None):
+        with self._lock:
+            instance = instance or xclass.lower()
+            workspace = workspace or self.focused_workspace
+            placeholder = self._find_placeholder(xclass, instance)
+            if placeholder is not None:
+                ws, con = placeholder
+                window = next(self._window_ids)
+                title = title or '%s %x' % (xclass, window)
+                con.update(name=title,
+                           window=window,
+                           swallows=[],
+                           window_properties={
+                               'class': xclass,
+                               'instance': instance,
+                               'title': title,
+                               'transient_for': None,
+                           })
+            else:
+                con = self._add_window(workspace, xclass, instance, title)
+            self._window_event('new', con)
+            return con['window']
+
+    def _find_placeholder(self, xclass, instance):
+        for ws in self.workspaces():
+            for leaf in self.leaves(ws):
+                for swallow in leaf['swallows']:
+                    if all(
+                            re.search(pattern, {
+                                'class': xclass,
+                                'instance': instance
+                            }.get(key, '')) for key, pattern in swallow.items()):
+                        return ws, leaf
+        return None
+
+    # Focuses the container with the given mark, like clicking on its tab.
+    # Returns False if no container has it.
+    def focus_mark(self, mark):
+        with self._lock:
+            for ws in self.workspaces():
+                for con in [ws] + self._descendants(ws):
+                    if mark in con['marks']:
+                        self._focus(ws)
+                        self._window_event('focus', con)
+                        return True
+            return False
+
+    def _descendants(self, node):
+        cons = []
+        for child in node['nodes'] + node['floating_nodes']:
+            cons.append(child)
+            cons.extend(self._descendants(child))
+        return cons
+
+    def close_window(self, window):
+        with self._lock:
+            ws, con = self.find_window(window)
+            if con is None:
+                raise KeyError('No such window: %s' % window)
+            self._remove(ws, con)
+            self._window_event('close', con)
+
+    def _remove(self, node, con):
+        for key in ['nodes', 'floating_nodes']:
+            if con in node[key]:
+                node[key].remove(con)
+                if con['id'] in node['focus']:
+                    node['focus'].remove(con['id'])
+                return True
+            for child in node[key]:
+                if self._remove(child, con):
+                    if child['type'] == 'con' and not child['nodes']:
+                        # collapse split containers that became empty
+                        node[key].remove(child)
+                    return True
+        return False
+
+    # Commands
+    ############################################################################
+
+    def command(self, payload):
+        with self._lock:
+            self.commands.append(payload)
+            return [self._run_command(c) for c in split_commands(payload)]
+
+    def _run_command(self, command):
+        try:
+            args = shlex.split(command)
+        except ValueError as e:
+            return {'success': False, 'parse_error': True, 'error': str(e)}
+        if not args:
+            return {'success': True}
+
+        handler = getattr(self, '_cmd_' + args[0], None)
+        if handler is None:
+            return {
+                'success': False,
+                'parse_error': True,
+                'error': 'Unknown command: %s' % args[0]
+            }
+        error = handler(args[1:])
+        if error:
+            return {'success': False, 'error': error}
+        return {'success': True}
+
+    def _cmd_nop(self, args):
+        return None
+
+    def _cmd_exec(self, args):
+        return None
+
+    def _cmd_workspace(self, args):
+        if args and args[0] == 'number':
+            num = _workspace_num(args[1])
+            workspace = self._workspace_by('num', num)
+            name = args[1]
+        else:
+            name = ' '.join(args)
+            workspace = self._workspace_by('name', name)
+        if workspace is None:
+            output = self._output_of(self.focused_workspace)
+            workspace = self._add_workspace(output, name)
+            self._workspace_event('init', workspace)
+        self._focus(workspace)
+        return None
+
+    def _cmd_rename(self, args):
+        # rename workspace [<old>] to <new>
+        if len(args) < 3 or args[0] != 'workspace' or args[-2] != 'to':
+            return 'Invalid rename command'
+        new_name = args[-1]
+        if new_name.startswith('__'):
+            return ('Cannot rename workspace to "%s": names starting with __ '
+                    'are i3-internal.' % new_name)
+        if len(args) == 3:
+            workspace = self.focused_workspace
+        else:
+            workspace = self._workspace_by('name', args[1])
+            if workspace is None:
+                return 'Old workspace "%s" not found' % args[1]
+        existing = self._workspace_by('name', new_name)
+        if existing is not None and existing is not workspace:
+            return 'New workspace "%s" already exists' % new_name
+        workspace['name'] = new_name
+        workspace['num'] = _workspace_num(new_name)
+        self._sort_workspaces(self._output_of(workspace)['nodes'][0])
+        self._workspace_event('rename', workspace)
+        return None
+
+    def _cmd_move(self, args):
+        # move [window|container] [to] workspace [number] <name>
+        args = [a for a in args if a not in ('window', 'container', 'to')]
+        if not args or args[0] != 'workspace':
+            return 'Unsupported move command'
+        source = self.focused_workspace
+        focused = self.leaves(source)
+        if args[1] == 'number':
+            target = self._workspace_by('num', _workspace_num(args[2]))
+            name = args[2]
+        else:
+            name = ' '.join(args[1:])
+            target = self._workspace_by('name', name)
+        if target is None:
+            target = self._add_workspace(self._output_of(source), name)
+            self._workspace_event('init', target)
+        if focused:
+            con = focused[-1]
+            self._remove(source, con)
+            target['nodes'].append(con)
+            self._window_event('move', con)
+        return None
+
+    def _cmd_unmark(self, args):
+        for ws in self.workspaces():
+            for con in [ws] + self._descendants(ws):
+                con['marks'] = [
+                    m for m in con['marks'] if args and m != args[0]
+                ]
+        return None
+
+    def _cmd_append_layout(self, args):
+        try:
+            with open(os.path.expanduser(args[0])) as f:
+                text = f.read()
+        except OSError as e:
+            return 'Could not read "%s": %s' % (args[0], e)
+
+        # The layout file may contain several JSON objects in a row.
+        decoder = json.JSONDecoder()
+        nodes = []
+        pos = 0
+        text = text.strip()
+        while pos < len(text):
+            node, pos = decoder.raw_decode(text, pos)
+            nodes.append(node)
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+
+        for node in nodes:
+            self.focused_workspace['nodes'].append(self._placeholder(node))
+        return None
+
+    def _placeholder(self, layout):
+        con = self._node('', 'con', output=self.focused_workspace['output'])
+        con['layout'] = layout.get('layout', 'splith')
+        con['percent'] = layout.get('percent')
+        con['swallows'] = layout.get('swallows', [])
+        con['marks'] = list(layout.get('marks', []))
+        con['nodes'] = [self._placeholder(n) for n in layout.get('nodes', [])]
+        return con
+
+    # IPC
+    ############################################################################
+
+    # Handles one ipc message and returns the JSON encoded reply.
+    def handle_message(self, client, msg_type, payload):
+        with self._lock:
+            self.message_counts[MESSAGE_NAMES.get(msg_type, msg_type)] += 1
+            return json.dumps(self._reply(client, msg_type, payload))
+
+    def _reply(self, client, msg_type, payload):
+        if msg_type == RUN_COMMAND:
+            return self.command(payload.decode('utf-8'))
+        if msg_type == GET_WORKSPACES:
+            return self.get_workspaces()
+        if msg_type == SUBSCRIBE:
+            self.subscribe(client, json.loads(payload))
+            return {'success': True}
+        if msg_type == GET_OUTPUTS:
+            return self.get_outputs()
+        if msg_type == GET_TREE:
+            return self.tree
+        if msg_type == GET_MARKS:
+            return []
+        if msg_type == SEND_TICK:
+            self.emit('tick', {
+                'first': False,
+                'payload': payload.decode('utf-8')
+            })
+            return {'success': True}
+        if msg_type == GET_VERSION:
+            return {
+                'major': 4,
+                'minor': 22,
+                'patch': 0,
+                'human_readable': '4.22 (fake_i3)',
+                'loaded_config_file_name': '',
+            }
+        return {'success': False, 'error': 'Unsupported message type'}
+
+
+class _Client(socketserver.BaseRequestHandler):
+    def setup(self):
+        self._send_lock = threading.Lock()
+
+    def send_raw(self, data):
+        with self._send_lock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+    def handle(self):
+        try:
+            while True:
+                message = recv_message(self.request)
+                if message is None:
+                    break
+                msg_type, payload = message
+                # The server's FakeI3 may be swapped out between messages.
+                reply = self.server.i3.handle_message(self, msg_type, payload)
+                self.send_raw(pack(msg_type, reply))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.server.i3.unsubscribe(self)
+
+
+# Serves a FakeI3 on a unix socket, with a thread per client connection.
+class FakeI3Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, i3=None):
+        self.i3 = i3 or FakeI3()
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _Client)
+        self._thread = None
+
+    # Starts serving in a background thread.
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Sends a message to the i3 (or fake) at socket_path and returns the decoded
+# reply.
+def send_message(socket_path, msg_type, payload=''):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(pack(msg_type, payload))
+        message = recv_message(sock)
+    return json.loads(message[1]) if message else None
+
+
+def _msg_main(args):
+    socket_path = args.socket or os.environ.get('I3SOCK')
+    if not socket_path:
+        sys.exit('No socket given and I3SOCK is not set')
+    msg_type = {v: k for k, v in MESSAGE_NAMES.items()}[args.type]
+    reply = send_message(socket_path, msg_type, ' '.join(args.message))
+    print(json.dumps(reply))
+    if msg_type == RUN_COMMAND and not all(r['success'] for r in reply):
+        sys.exit(2)
+
+
+def _serve_main(args):
+    i3 = FakeI3.synthetic(args.outputs, args.workspaces, args.windows)
+    server = FakeI3Server(args.socket, i3)
+    print('Serving a fake i3 on %s' % args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="A fake i3 ipc server for testing and benchmarking.")
+    subparsers = parser.add_subparsers(dest='subcommand', required=True)
+
+    serve = subparsers.add_parser('serve',
+                                  help="Serve a synthetic layout tree.")
+    serve.add_argument('--socket', default='/tmp/fake-i3.sock')
+    serve.add_argument('--outputs', type=int, default=2)
+    serve.add_argument('--workspaces',
+                       type=int,
+                       default=4,
+                       help="Number of workspaces per output.")
+    serve.add_argument('--windows',
+                       type=int,
+                       default=3,
+                       help="Number of windows per workspace.")
+
+    msg = subparsers.add_parser(
+        'msg', help="Send a message, like i3-msg. Uses $I3SOCK by default.")
+    msg.add_argument('--socket', '-s')
+    msg.add_argument('--type',
+                     '-t',
+                     default='command',
+                     choices=sorted(MESSAGE_NAMES.values()))
+    msg.add_argument('message', nargs='*')
+
+    args = parser.parse_args()
+    if args.subcommand == 'serve':
+        _serve_main(args)
+    else:
+        _msg_main(args)
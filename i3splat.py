@@ -22,26 +22,52 @@
 #   )])
 #   ws.launch()
 #
+# launch() starts the apps in parallel where i3 can tell their windows apart
+# (see launch_apps()) and returns how long each one took to show a window:
+#
+#   for app, seconds in ws.launch():
+#       print(app.swallows, seconds)
+#
 # Instead of calling launch(), you can also print out the i3 layout json
 # representation for debugging purposes:
 #
 #   print(ws.serialize_i3layout())
 #
+# To set up several workspaces at once, put them in a Session.  It numbers all
+# of them in one go, appends every layout over a single i3 connection and then
+# starts all of their apps together:
+#
+#   Session([ws, Workspace("mail", [(1.0, chrome(["mail.google.com"]))])]).launch()
+#
+# A Session can also be captured from the running i3 and restored later, for
+# example after a reboot:
+#
+#   ./i3splat.py snapshot ~/.config/i3/session.json
+#   ./i3splat.py restore ~/.config/i3/session.json
+#
+# Starting every app in a TABBED or STACKED container at once can stall the
+# machine when they're heavy, although only one tab of each is shown.  With
+# launch(lazy=True) (or restore --lazy) the apps in hidden tabs get their
+# placeholders, but only start once their tab is first focused.
+#
 # Customization:
 #
 # * This script is mostly independent of the other ones in this repository. You
-#   will just need to modify or replace the Workspace.launch() method. See
+#   will just need to modify or replace the Session.launch() method. See
 #   comments in that method for more info.
 #
 # * This module provides functions for a few common apps, but you will likely
 #   want to add your own. See the ones at the bottom of this file as examples.
 
+import contextlib
 import subprocess
 import os
 import json
 import time
 import shlex
 import sys
+import logging
+from collections import namedtuple
 
 
 class Node:
@@ -63,35 +89,57 @@ class Container(Node):
         self.nodes = _flatten_tuples(nodes_and_percents)
 
 
+# Either xClass (and optionally xInstance) or a list of i3 swallow criteria
+# must be given.
 class App(Node):
-    def __init__(self, xClass, xInstance=None, command=None):
+    def __init__(self, xClass=None, xInstance=None, command=None,
+                 swallows=None):
         super().__init__()
         self.command = command
 
+        if swallows != None:
+            self.swallows = swallows
+            return
         self.swallows = [{'class': '^%s$' % xClass}]
         if xInstance != None:
             self.swallows[0]['instance'] = '^%s$' % xInstance
 
+    # Whether a window with the given properties (as in the 'window_properties'
+    # of an i3 container) would be swallowed by this app's placeholder.
+    def matches(self, window_properties):
+        import re
+        for criteria in self.swallows:
+            if all(
+                    re.search(pattern, window_properties.get(key) or '')
+                    for key, pattern in criteria.items()):
+                return True
+        return False
+
+    # Whether a window of one of these apps could land in the other's
+    # placeholder.  This is a conservative check on the criteria rather than the
+    # regexes: two apps with the same class only can't be told apart unless
+    # both specify different instances.
+    def conflicts_with(self, other):
+        for a in self.swallows:
+            for b in other.swallows:
+                if a.get('class') != b.get('class'):
+                    continue
+                if 'instance' not in a or 'instance' not in b or a[
+                        'instance'] == b['instance']:
+                    return True
+        return False
+
 
 class Workspace:
     def __init__(self, name, nodes_and_percents):
         self.name = name
         self.nodes = _flatten_tuples(nodes_and_percents)
 
-    # Main entry point.
-    def launch(self):
-        # Find an unused workspace number and jump to it.
-        from new_workspace import new_workspace
-        new_workspace()
-
-        # Rename the new workspace. Note that you may want to remove this or
-        # replace it with your own script if you're not also using the
-        # autoname_workspaces script in this directory.
-        from rename_workspace import rename_workspace
-        rename_workspace(self.name)
-
-        self.load_i3layout()
-        self.run_apps()
+    # Main entry point.  Returns the launch_apps() report, or None if 'timeout'
+    # is None, in which case the apps are started without waiting for their
+    # windows.  'i3' and 'lazy' are as for Session.launch().
+    def launch(self, timeout=10.0, i3=None, lazy=False):
+        return Session([self]).launch(timeout, i3=i3, lazy=lazy)
 
     def iterate_apps(self):
         def _iterate_node(node):
@@ -104,23 +152,44 @@ class Workspace:
         for node in self.nodes:
             yield from _iterate_node(node)
 
+    # Yields the apps that aren't shown once the layout is loaded: the ones in
+    # any tab of a TABBED or STACKED container but the first.
+    def iterate_hidden_apps(self):
+        def _iterate_node(node, hidden):
+            if isinstance(node, App):
+                if hidden:
+                    yield node
+                return
+            tabs = node.layout in [TABBED, STACKED]
+            for i, child in enumerate(node.nodes):
+                yield from _iterate_node(child, hidden or (tabs and i > 0))
+
+        for node in self.nodes:
+            yield from _iterate_node(node, False)
+
     def serialize_i3layout(self):
         return '\n\n'.join([
             json.dumps(n, cls=WorkspaceJSONEncoder, indent=4)
             for n in self.nodes
         ])
 
-    def load_i3layout(self):
-        fname = "/tmp/i3layout.json"
-        with open(fname, "w") as f:
-            f.write(self.serialize_i3layout())
-
-        subprocess.check_call(["i3-msg", "append_layout", fname])
+    # Appends this workspace's layout to the focused workspace, over the given
+    # i3 connection (a util.LiteConnection or i3ipc.Connection) if there is
+    # one, otherwise with i3-msg.
+    def load_i3layout(self, i3=None):
+        with _layout_file(self.serialize_i3layout()) as fname:
+            if i3 is None:
+                subprocess.check_call(["i3-msg", "append_layout", fname])
+            else:
+                res = i3.command('append_layout %s' % fname)
+                assert res[0].success, "Failed to load layout: %s" % res[
+                    0].error
 
     # If delay is provided, wait a small amount of time between each app launch
     # to give it time to load its window. This helps ensure that they get placed
     # in the appropriate containers for apps that can't be launched with a
-    # custom instance name.
+    # custom instance name.  launch_apps() does the same by waiting for each
+    # window instead.
     def run_apps(self, delay=None):
         for app in self.iterate_apps():
             if app.command != None:
@@ -129,6 +198,238 @@ class Workspace:
                     time.sleep(delay)
 
 
+# A group of workspaces that are set up together.
+class Session:
+    def __init__(self, workspaces):
+        self.workspaces = list(workspaces)
+
+    # Picks a number for each workspace, to the right of the existing
+    # workspaces on the focused monitor, from a single query to i3.
+    def allocate_numbers(self, i3):
+        workspaces = i3.get_workspaces()
+        output = [w for w in workspaces if w.focused][0].output
+        maxnum = max([w.num for w in workspaces if w.output == output] + [0])
+        return [maxnum + 1 + i for i in range(len(self.workspaces))]
+
+    # Creates every workspace with its layout, then starts all of the apps.
+    # Returns the launch_apps() report for all workspaces together, or None if
+    # 'timeout' is None, in which case the apps are started without waiting for
+    # their windows.  'i3' can be a connection or util.I3Context to reuse;
+    # otherwise one is made for the duration of the launch.
+    #
+    # With 'lazy', the apps in hidden tabs (see
+    # Workspace.iterate_hidden_apps()) still get their placeholders, but are
+    # only started when their placeholder is first focused, by
+    # launch_on_focus().  They're left out of the report, and the process keeps
+    # running until all of them have started.
+    def launch(self, timeout=10.0, socket_path=None, i3=None, lazy=False):
+        from util import (I3Context, NameParts, construct_workspace_name,
+                          quote_workspace_name)
+
+        lazy_apps = {}
+        if lazy:
+            hidden = [
+                a for w in self.workspaces for a in w.iterate_hidden_apps()
+                if a.command != None
+            ]
+            for n, app in enumerate(hidden):
+                # marks starting with '_' aren't shown in window titles
+                app.marks = ['_i3splat_%d_%d' % (os.getpid(), n)]
+                lazy_apps[app.marks[0]] = app
+
+        context = i3 if isinstance(i3, I3Context) else I3Context(
+            i3, socket_path)
+        socket_path = getattr(context.i3, 'socket_path', socket_path)
+        try:
+            for workspace, num in zip(self.workspaces,
+                                      self.allocate_numbers(context)):
+                # Jump to a new workspace with the name already in the format
+                # used by autoname_workspaces.py. You may want to change this if
+                # you're not using that script.
+                name = construct_workspace_name(
+                    NameParts(num=num, shortname=workspace.name, icons=None))
+                context.command('workspace %s' % quote_workspace_name(name))
+                workspace.load_i3layout(context)
+        finally:
+            if context is not i3:
+                context.close()
+            for app in lazy_apps.values():
+                del app.marks
+
+        if lazy_apps:
+            launch_on_focus(lazy_apps, socket_path)
+        apps = [
+            a for w in self.workspaces for a in w.iterate_apps()
+            if a not in lazy_apps.values()
+        ]
+        if timeout is None:
+            for app in apps:
+                if app.command != None:
+                    app.command()
+            return None
+        return launch_apps(apps, timeout, socket_path)
+
+
+# Writes an i3 layout to a file that i3 can read and yields its path.  The file
+# lives in memory where the system supports it and is removed afterwards, so
+# concurrent launches never share a file.
+@contextlib.contextmanager
+def _layout_file(text):
+    data = text.encode('utf-8')
+    if hasattr(os, 'memfd_create') and os.path.isdir('/proc/self/fd'):
+        fd = os.memfd_create('i3layout')
+        try:
+            os.write(fd, data)
+            # i3 runs as the same user, so it can open our fd through /proc.
+            yield '/proc/%d/fd/%d' % (os.getpid(), fd)
+        finally:
+            os.close(fd)
+        return
+
+    import tempfile
+    with tempfile.NamedTemporaryFile(prefix='i3layout-',
+                                      suffix='.json') as f:
+        f.write(data)
+        f.flush()
+        yield f.name
+
+
+LaunchResult = namedtuple('LaunchResult', ['app', 'seconds'])
+
+
+# Splits apps into chains that can be launched in parallel with each other.
+# Apps whose windows could be confused (see App.conflicts_with()) end up in the
+# same chain, in their original order, and have to be started one at a time.
+def _launch_chains(apps):
+    chains = []
+    for app in apps:
+        conflicting = [
+            c for c in chains if any(app.conflicts_with(a) for a in c)
+        ]
+        chain = [a for c in conflicting for a in c] + [app]
+        chain.sort(key=apps.index)
+        chains = [c for c in chains if c not in conflicting] + [chain]
+    return chains
+
+
+# Starts the given apps and waits for each one's window to appear, instead of
+# sleeping for a fixed delay between launches.  Apps that i3 can tell apart
+# start immediately; the others start once the window of the app before them
+# shows up, or once that app times out after 'timeout' seconds.
+#
+# Returns a LaunchResult for each app with a command, in the given order, with
+# the number of seconds until its window appeared, or None if it timed out.
+def launch_apps(apps, timeout=10.0, socket_path=None):
+    from util import LiteConnection
+
+    apps = [a for a in apps if a.command != None]
+    chains = _launch_chains(apps)
+    chain_of = {app: chain for chain in chains for app in chain}
+    results = {}
+    started = {}  # app -> launch time, for apps still waiting for a window
+
+    def start_next(chain):
+        if chain:
+            app = chain.pop(0)
+            started[app] = time.perf_counter()
+            app.command()
+
+    # Subscribe before launching anything so that no window can be missed.
+    events = LiteConnection(socket_path)
+    try:
+        events.subscribe(['window'])
+        for chain in chains:
+            start_next(chain)
+
+        while started:
+            now = time.perf_counter()
+            for app, start in list(started.items()):
+                if now - start >= timeout:
+                    logging.warning('No window for %s after %.1fs' %
+                                    (app.swallows, timeout))
+                    results[app] = None
+                    del started[app]
+                    start_next(chain_of[app])
+            if not started:
+                break
+            deadline = min(started.values()) + timeout
+            event = events.read_event(max(0, deadline - time.perf_counter()))
+            if event is None or event[0] != 'window' or event[1].get(
+                    'change') != 'new':
+                continue
+            props = event[1]['container'].get('window_properties') or {}
+            # Oldest launch first, in case several apps could match.
+            for app in sorted(started, key=started.get):
+                if app.matches(props):
+                    results[app] = time.perf_counter() - started.pop(app)
+                    start_next(chain_of[app])
+                    break
+    finally:
+        events.close()
+
+    return [LaunchResult(app, results.get(app)) for app in apps]
+
+
+# Starts each of the given apps (a dict of mark -> App) when the container with
+# its mark is first focused, e.g. when its tab is clicked, then removes the
+# mark.  This happens on a background thread that keeps the process running
+# until every app has started or lost its placeholder (because it was closed
+# or its workspace went away).  Returns the thread.
+def launch_on_focus(apps, socket_path=None):
+    import threading
+    from util import LiteConnection
+
+    apps = dict(apps)
+    events = LiteConnection(socket_path)
+    events.subscribe(['window', 'workspace'])
+
+    def start(mark):
+        app = apps.pop(mark)
+        logging.info('Starting %s' % app.swallows)
+        app.command()
+        events.command('unmark %s' % mark)
+
+    # Forgets the apps whose placeholders are gone and starts the ones whose
+    # placeholders are focused already.
+    def check_tree():
+        found = {}
+        cons = [events.get_tree()]
+        while cons:
+            con = cons.pop()
+            for mark in con.get('marks') or []:
+                found[mark] = con.get('focused', False)
+            cons.extend(con['nodes'])
+            cons.extend(con.get('floating_nodes') or [])
+        for mark in list(apps):
+            if mark not in found:
+                logging.info('Not starting %s, its placeholder is gone' %
+                             apps.pop(mark).swallows)
+            elif found[mark]:
+                start(mark)
+
+    def run():
+        try:
+            check_tree()
+            while apps:
+                name, data = events.read_event()
+                change = data.get('change')
+                if name == 'window' and change == 'focus':
+                    for mark in data['container'].get('marks') or []:
+                        if mark in apps:
+                            start(mark)
+                elif (name, change) in [('window', 'close'),
+                                        ('workspace', 'empty')]:
+                    check_tree()
+        except OSError as e:
+            logging.warning('Lost the connection to i3: %s' % e)
+        finally:
+            events.close()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
 class WorkspaceJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, App):
@@ -157,6 +458,19 @@ def _flatten_tuples(pairs):
 ################################################################################
 
 
+# Starts a program from its argument list, in the given working directory if it
+# still exists.  Unlike the commands from _cmd(), these can be saved in a
+# snapshot.
+class Command:
+    def __init__(self, argv, cwd=None):
+        self.argv = argv
+        self.cwd = cwd
+
+    def __call__(self):
+        cwd = self.cwd if self.cwd and os.path.isdir(self.cwd) else None
+        return subprocess.Popen(self.argv, cwd=cwd, start_new_session=True)
+
+
 def _cmd(args):
     joined = ' '.join(args)
     print("$ %s" % joined)
@@ -186,3 +500,173 @@ def chrome(urls):
 def sublime(paths):
     quoted_paths = [shlex.quote(p) for p in paths]
     return App(command=_cmd(["subl", "-n"] + quoted_paths), xClass="Subl")
+
+
+# Snapshots
+################################################################################
+
+
+# Captures the workspaces in the running i3 as a Session, keeping each
+# container's layout and percent.  Every window becomes an App that swallows
+# its exact class and instance.  If the process that owns the window can be
+# found through _NET_WM_PID, the App also gets a Command that starts the same
+# program in the same directory.  Floating windows are left out.
+def snapshot(socket_path=None):
+    from util import LiteConnection, parse_workspace_name, xprop_many
+
+    i3 = LiteConnection(socket_path)
+    try:
+        tree = i3.get_tree()
+    finally:
+        i3.close()
+
+    workspaces = [
+        ws for output in tree['nodes'] if not output['name'].startswith('__')
+        for content in output['nodes'] if content['name'] == 'content'
+        for ws in content['nodes'] if ws['type'] == 'workspace'
+    ]
+
+    def windows(con):
+        if con.get('window'):
+            yield con['window']
+        for child in con['nodes']:
+            yield from windows(child)
+
+    win_ids = [w for ws in workspaces for w in windows(ws)]
+    pids = xprop_many(win_ids, '_NET_WM_PID') if win_ids else {}
+    commands = {}
+    for win_id in win_ids:
+        pid = (pids.get(win_id) or [None])[0]
+        if pid is not None:
+            commands[win_id] = _process_command(pid)
+
+    session = Session([])
+    for ws in workspaces:
+        nodes = _snapshot_nodes(ws['nodes'], commands)
+        if not nodes:
+            continue
+        if len(nodes) > 1 and ws['layout'] != SPLITH:
+            nodes = [(1.0, Container(ws['layout'], nodes))]
+        # Only the shortname is kept, restored workspaces get new numbers.
+        name = parse_workspace_name(ws['name']).shortname
+        session.workspaces.append(Workspace(name, nodes))
+    return session
+
+
+# The command line and working directory of a running process, or None if it
+# can't be read.
+def _process_command(pid):
+    try:
+        with open('/proc/%d/cmdline' % pid, 'rb') as f:
+            argv = [a.decode('utf-8') for a in f.read().split(b'\0') if a]
+        cwd = os.readlink('/proc/%d/cwd' % pid)
+    except (OSError, UnicodeDecodeError):
+        return None
+    return Command(argv, cwd) if argv else None
+
+
+# Turns i3 containers into (percent, Node) pairs, dropping the ones without
+# windows and scaling the percents of the rest so that they still add up to 1.
+def _snapshot_nodes(cons, commands):
+    import re
+
+    pairs = []
+    for con in cons:
+        if con.get('window'):
+            props = con.get('window_properties') or {}
+            if not props.get('class'):
+                continue
+            node = App(xClass=re.escape(props['class']),
+                       xInstance=re.escape(props['instance'])
+                       if props.get('instance') else None,
+                       command=commands.get(con['window']))
+        else:
+            children = _snapshot_nodes(con['nodes'], commands)
+            if not children:
+                continue
+            node = Container(con['layout'], children)
+        pairs.append((con.get('percent'), node))
+
+    if not pairs:
+        return []
+    percents = [p or 1 / len(pairs) for p, _ in pairs]
+    total = sum(percents)
+    return [(p / total, node) for p, (_, node) in zip(percents, pairs)]
+
+
+# Snapshots are saved as compact JSON:
+#   {"v": 1, "w": [workspace, ...]}
+# where a workspace is {"n": name, "c": [node, ...]}, a container is
+# {"p": percent, "l": layout, "c": [node, ...]} and an app is
+# {"p": percent, "w": swallows, "x": argv, "d": cwd}.  Apps whose command isn't
+# a Command are saved without "x" and "d" and get only a placeholder on restore.
+def save(session, path):
+    def node(n):
+        if isinstance(n, App):
+            d = {'p': n.percent, 'w': n.swallows}
+            if isinstance(n.command, Command):
+                d['x'] = n.command.argv
+                d['d'] = n.command.cwd
+            return d
+        return {'p': n.percent, 'l': n.layout, 'c': [node(c) for c in n.nodes]}
+
+    data = {
+        'v': 1,
+        'w': [{
+            'n': ws.name,
+            'c': [node(n) for n in ws.nodes]
+        } for ws in session.workspaces]
+    }
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def load(path):
+    def pair(d):
+        if 'l' in d:
+            return d['p'], Container(d['l'], [pair(c) for c in d['c']])
+        command = Command(d['x'], d.get('d')) if d.get('x') else None
+        return d['p'], App(swallows=d['w'], command=command)
+
+    with open(path) as f:
+        data = json.load(f)
+    return Session([
+        Workspace(ws['n'], [pair(n) for n in ws['c']]) for ws in data['w']
+    ])
+
+
+# Restores a saved snapshot: every layout is appended first, then all of the
+# apps are started in parallel (or, with 'lazy', the ones in hidden tabs once
+# they're focused).  Returns the launch_apps() report.
+def restore(path, timeout=10.0, socket_path=None, lazy=False):
+    return load(path).launch(timeout, socket_path, lazy=lazy)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Save the running i3 session or restore a saved one.")
+    parser.add_argument('action', choices=['snapshot', 'restore'])
+    parser.add_argument('file')
+    parser.add_argument('--timeout',
+                        type=float,
+                        default=10.0,
+                        help="Seconds to wait for each app's window.")
+    parser.add_argument(
+        '--lazy',
+        action='store_true',
+        help=
+        "Start the apps in hidden tabs only once their tab is first focused.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.action == 'snapshot':
+        save(snapshot(), args.file)
+    else:
+        start = time.perf_counter()
+        for app, seconds in restore(args.file, args.timeout, lazy=args.lazy):
+            print('%-40s %s' % (app.swallows[0], 'timed out' if seconds is None
+                                else '%.2fs' % seconds))
+        print('restored in %.2fs' % (time.perf_counter() - start))
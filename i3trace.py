@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+#
+# github.com/justbuchanan/i3scripts
+#
+# Records what autoname_workspaces.py sees from i3 (events, and the replies to
+# its get_tree, get_workspaces and command messages) to a trace file, and
+# replays such a trace offline, without i3 or an X server, to see which rename
+# commands the current code produces for it and how long each event takes.
+#
+#   ./autoname_workspaces.py --record ~/autoname.trace.xz
+#   ./i3trace.py ~/autoname.trace.xz
+#   ./i3trace.py ~/autoname.trace.xz --commands
+#
+# A trace is a sequence of JSON arrays, one per line, compressed with xz:
+#   ["v", 1, start time]
+#   ["e", seconds, event type, event payload]
+#   ["r", seconds, message type, message payload, reply]
+# A reply that's identical to the previous reply to the same message type is
+# stored as null.  xz finds the redundancy between successive layout trees, so
+# a trace costs far less than the trees it contains.
+#
+# Replies recorded after an event belong to that event: on replay, each event
+# is handled with the i3 state that was recorded while the event was handled
+# live, no matter how many messages the replayed code sends.  Rename commands
+# that weren't recorded are answered with success.
+
+import json
+import logging
+import lzma
+import sys
+import threading
+import time
+from collections import namedtuple
+
+import i3ipc
+
+VERSION = 1
+
+# i3 ipc message type of a command
+COMMAND = 0
+
+
+# i3ipc passes message types as an enum.
+def _message_type(message_type):
+    return getattr(message_type, 'value', message_type)
+
+
+class Recorder:
+    def __init__(self, path):
+        self._file = lzma.open(path, 'wt', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._start = time.time()
+        self._last = {}
+        self._write(['v', VERSION, self._start])
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _time(self):
+        return round(time.time() - self._start, 4)
+
+    # Records every message sent on the given i3ipc.Connection and its reply.
+    # This wraps the private _message() of i3ipc 2.x connections.
+    def wrap(self, i3):
+        message = getattr(i3, '_message', None)
+        if message is None:
+            logging.warning('Unable to record i3 replies with this version '
+                            'of i3ipc')
+            return i3
+
+        def recorded(message_type, payload):
+            reply = message(message_type, payload)
+            message_type = _message_type(message_type)
+            if (message_type != COMMAND
+                    and self._last.get(message_type) == reply):
+                data = None
+            else:
+                self._last[message_type] = reply
+                data = json.loads(reply) if reply else None
+            self._write(['r', self._time(), message_type, payload, data])
+            return reply
+
+        i3._message = recorded
+        return i3
+
+    # Records an event, e.g. ('window::new', e.ipc_data).
+    def event(self, event_type, payload):
+        self._write(['e', self._time(), event_type, payload])
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+# Yields the records of a trace.  A trace that was cut off (e.g. because the
+# recording process was killed) is read up to where it ends.
+def read_trace(path):
+    with lzma.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                yield json.loads(line)
+        except (EOFError, lzma.LZMAError, json.JSONDecodeError):
+            logging.warning('Trace %s is truncated' % path)
+
+
+# Splits the records of a trace into the replies recorded at startup and a list
+# of (event type, payload, replies) tuples, where replies is a list of
+# (message type, message payload, reply text) tuples.
+def split_trace(records):
+    startup = []
+    events = []
+    replies = startup
+    last = {}
+    for record in records:
+        if record[0] == 'e':
+            replies = []
+            events.append((record[2], record[3], replies))
+        elif record[0] == 'r':
+            _, _, message_type, payload, data = record
+            if data is None and message_type != COMMAND:
+                reply = last[message_type]
+            else:
+                reply = json.dumps(data)
+            last[message_type] = reply
+            replies.append((message_type, payload, reply))
+    return startup, events
+
+
+# An i3ipc.Connection that answers from a trace instead of a socket.  Call
+# load() with the replies recorded for an event before replaying it.  Every
+# command sent is appended to 'commands'.
+class ReplayConnection(i3ipc.Connection):
+    def __init__(self):
+        # message type -> replies recorded for the current event; the last one
+        # stays around as the current state
+        self._replies = {}
+        # command payload -> recorded replies for the current event
+        self._command_replies = {}
+        self.commands = []
+
+    def load(self, replies):
+        by_type = {}
+        self._command_replies = {}
+        for message_type, payload, reply in replies:
+            if message_type == COMMAND:
+                self._command_replies.setdefault(payload, []).append(reply)
+            else:
+                by_type.setdefault(message_type, []).append(reply)
+        self._replies.update(by_type)
+
+    def _message(self, message_type, payload):
+        from fake_i3 import split_commands
+
+        message_type = _message_type(message_type)
+        if message_type == COMMAND:
+            self.commands.append(payload)
+            recorded = self._command_replies.get(payload)
+            if recorded:
+                return recorded.pop(0)
+            return json.dumps([{
+                'success': True
+            } for _ in split_commands(payload)])
+
+        replies = self._replies.get(message_type)
+        if not replies:
+            raise ValueError('The trace has no reply to message type %d' %
+                             message_type)
+        return replies.pop(0) if len(replies) > 1 else replies[0]
+
+    def main_quit(self):
+        pass
+
+
+# Stands in for the xprop backend during a replay, since there is no X server.
+# Windows that i3 didn't report a class for get none.
+class _NoXprop:
+    lookups = 0
+
+    def get(self, win_id, property):
+        self.lookups += 1
+        return None
+
+    def get_many(self, win_ids, property):
+        return {win_id: self.get(win_id, property) for win_id in win_ids}
+
+
+ReplayResult = namedtuple('ReplayResult', ['commands', 'metrics'])
+
+
+def _event(event_type, payload, i3):
+    if event_type == 'tick':
+        return i3ipc.TickEvent(payload)
+    if event_type.startswith('workspace::'):
+        return i3ipc.WorkspaceEvent(payload, i3)
+    return i3ipc.WindowEvent(payload, i3)
+
+
+# Replays a trace through autoname_workspaces: the startup rename pass, then
+# handle_event() for every event, then on_exit().  Returns the commands sent
+# and a metrics.Metrics with the time spent on each event.
+def replay(path, icon_list_format='default', incremental=True):
+    import autoname_workspaces
+    import metrics
+    import util
+
+    autoname_workspaces.STATE = autoname_workspaces.RenameState()
+    autoname_workspaces.WINDOW_CLASSES = autoname_workspaces.WindowClassCache()
+    autoname_workspaces.compile_window_icons()
+    util.set_xprop_backend(_NoXprop())
+
+    startup, events = split_trace(read_trace(path))
+    stats = metrics.Metrics()
+    autoname_workspaces.METRICS = stats
+    i3 = stats.count_ipc(ReplayConnection())
+
+    i3.load(startup)
+    start, ipc = time.perf_counter(), stats.ipc
+    autoname_workspaces.rename_workspaces(i3, icon_list_format)
+    stats.observe('startup', start, stats.ipc - ipc)
+
+    for event_type, payload, replies in events:
+        i3.load(replies)
+        e = _event(event_type, payload, i3)
+        start, ipc = time.perf_counter(), stats.ipc
+        autoname_workspaces.handle_event(i3, e, icon_list_format, incremental)
+        stats.observe(event_type, start, stats.ipc - ipc)
+
+    start, ipc = time.perf_counter(), stats.ipc
+    try:
+        autoname_workspaces.on_exit(i3)
+    except SystemExit:
+        pass
+    stats.observe('exit', start, stats.ipc - ipc)
+    return ReplayResult(i3.commands, stats)
+
+
+if __name__ == '__main__':
+    import argparse
+    from util import icon_list_formatter
+    parser = argparse.ArgumentParser(
+        description=
+        "Replay a trace recorded with autoname_workspaces.py --record.")
+    parser.add_argument('trace')
+    parser.add_argument('--commands',
+                        action='store_true',
+                        help="Print every command sent to i3.")
+    parser.add_argument('--icon_list_format',
+                        type=icon_list_formatter,
+                        default='default')
+    parser.add_argument('--noincremental', action='store_true')
+    parser.add_argument('--json',
+                        action='store_true',
+                        help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    result = replay(args.trace, args.icon_list_format, not args.noincremental)
+    if args.json:
+        json.dump({
+            'commands': result.commands,
+            'metrics': result.metrics.as_dict()
+        },
+                  sys.stdout,
+                  indent=2)
+        print()
+        sys.exit(0)
+    if args.commands:
+        for command in result.commands:
+            print(command)
+        print()
+    print('%d commands' % len(result.commands))
+    print(result.metrics.format())
@@ -0,0 +1,135 @@
+# github.com/justbuchanan/i3scripts
+#
+# A lightweight reader for i3's layout tree.  i3ipc's get_tree() turns every
+# container into a Con object holding all of its properties (rects, gaps,
+# marks, the raw reply, ...), although autoname_workspaces.py only reads names,
+# ids, types and window classes.  get_tree() here builds Nodes with just those
+# fields, directly from the JSON decoder, so handling an event allocates a
+# fraction of the memory and the rest of the reply is freed right away.
+#
+# Nodes support the parts of the i3ipc.Con interface that the scripts use:
+# nodes, floating_nodes, focus, focused, urgent, leaves(), workspaces(),
+# workspace(), find_by_id() and iteration over descendants in the same
+# breadth-first order.
+
+import json
+from collections import deque
+
+
+class Node:
+    __slots__ = [
+        'id', 'type', 'name', 'num', 'output', 'window', 'window_class',
+        'window_instance', 'focus', 'focused', 'urgent', 'nodes',
+        'floating_nodes', 'parent'
+    ]
+
+    def __iter__(self):
+        queue = deque(self.nodes)
+        queue.extend(self.floating_nodes)
+        while queue:
+            con = queue.popleft()
+            yield con
+            queue.extend(con.nodes)
+            queue.extend(con.floating_nodes)
+
+    def __repr__(self):
+        return '<Node %s %d %r>' % (self.type, self.id, self.name)
+
+    def root(self):
+        con = self
+        while con.parent is not None:
+            con = con.parent
+        return con
+
+    def leaves(self):
+        return [
+            c for c in self if not c.nodes and c.type == 'con'
+            and c.parent.type != 'dockarea'
+        ]
+
+    def workspaces(self):
+        workspaces = []
+
+        def collect_workspaces(con):
+            if con.type == 'workspace' and not con.name.startswith('__'):
+                workspaces.append(con)
+                return
+            for c in con.nodes:
+                collect_workspaces(c)
+
+        collect_workspaces(self.root())
+        return workspaces
+
+    def workspace(self):
+        con = self
+        while con is not None and con.type != 'workspace':
+            con = con.parent
+        return con
+
+    def find_by_id(self, id):
+        return next((c for c in self if c.id == id), None)
+
+
+# The JSON decoder calls this for every object, innermost first, so children
+# are already Nodes when their parent is made.  Objects that aren't containers
+# (rects, window_properties, ...) are returned unchanged and dropped once their
+# container has read what it needs from them.
+def _object_hook(d):
+    if 'nodes' not in d or 'type' not in d:
+        return d
+    node = Node()
+    node.id = d.get('id')
+    node.type = d['type']
+    node.name = d.get('name')
+    node.num = d.get('num')
+    node.output = d.get('output')
+    node.window = d.get('window')
+    props = d.get('window_properties') or {}
+    node.window_class = props.get('class')
+    node.window_instance = props.get('instance')
+    node.focus = d.get('focus') or []
+    node.focused = d.get('focused', False)
+    node.urgent = d.get('urgent', False)
+    node.nodes = d['nodes']
+    node.floating_nodes = d.get('floating_nodes') or []
+    node.parent = None
+    for child in node.nodes:
+        child.parent = node
+    for child in node.floating_nodes:
+        child.parent = node
+    return node
+
+
+# Parses a get_tree reply (str or bytes) into the root Node.
+def parse_tree(data):
+    return json.loads(data, object_hook=_object_hook)
+
+
+# i3ipc has no public way to get a reply without parsing it, so this relies on
+# the private _message() of i3ipc 2.x connections.  Returns None when the
+# connection doesn't have it.
+def _get_tree_message(i3):
+    try:
+        from i3ipc._private import MessageType
+    except ImportError:
+        return None
+    if not hasattr(i3, '_message'):
+        return None
+    return MessageType.GET_TREE
+
+
+# Gets the tree over an i3ipc.Connection without building i3ipc.Con objects.
+# Falls back to converting i3ipc's own tree on other versions of i3ipc.
+def get_tree(i3):
+    message_type = _get_tree_message(i3)
+    if message_type is None:
+        return parse_tree(json.dumps(i3.get_tree().ipc_data))
+    return parse_tree(i3._message(message_type, ''))
+
+
+# Same as get_tree(), for an i3ipc.aio connection.
+async def get_tree_async(i3):
+    message_type = _get_tree_message(i3)
+    if message_type is None:
+        return parse_tree(json.dumps((await i3.get_tree()).ipc_data))
+    return parse_tree(await i3._message(message_type, ''))
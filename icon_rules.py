@@ -0,0 +1,168 @@
+# github.com/justbuchanan/i3scripts
+#
+# Rules for choosing an icon for a window, compiled into a form that's cheap to
+# query on every event.
+#
+# A rule matches one field of a window:
+# * 'class'    - the X window class (second part of WM_CLASS)
+# * 'instance' - the X window instance (first part of WM_CLASS)
+# * 'title'    - the window title
+# * 'any'      - either the instance or the class
+# using one of three kinds of pattern:
+# * exact(...) - case-insensitive string comparison
+# * glob(...)  - shell-style wildcards, e.g. 'jetbrains-*'
+# * regex(...) - a regular expression that must match the whole field; anchors
+#                and inline flags like (?i) work as usual
+# All matching is case-insensitive.  When several rules match a window, the
+# one with the highest priority wins.  Ties go to exact rules over patterns,
+# then to a match on the instance over the class over the title (as when icons
+# were looked up by the WM_CLASS values in order), then to the rule listed
+# first.
+#
+# IconMatcher puts all exact rules into dicts, so looking them up costs the
+# same with hundreds of rules as with a handful.  Pattern rules are tried in
+# order of precedence until one matches.  Results are memoized per (class,
+# instance, title).
+#
+# Rules can also be read from a JSON file with load_config().
+
+import fnmatch
+import functools
+import json
+import logging
+import re
+from collections import namedtuple
+
+IconRule = namedtuple('IconRule', ['field', 'kind', 'pattern', 'icon',
+                                   'priority'])
+
+FIELDS = ['instance', 'class', 'title']
+
+
+def exact(value, icon, field='any', priority=0):
+    return IconRule(field, 'exact', value, icon, priority)
+
+
+def glob(pattern, icon, field='any', priority=0):
+    return IconRule(field, 'glob', pattern, icon, priority)
+
+
+def regex(pattern, icon, field='any', priority=0):
+    return IconRule(field, 'regex', pattern, icon, priority)
+
+
+# Turns a {name: icon} dict (like WINDOW_ICONS) into exact rules that match
+# either the window's class or instance.
+def rules_from_dict(icons, priority=0):
+    return [exact(name, icon, priority=priority) for name, icon in icons.items()]
+
+
+# Reads icon rules from a JSON file like:
+#
+#   {
+#     "icons": {"firefox": "fa:firefox", "kitty": "K"},
+#     "rules": [
+#       {"kind": "regex", "pattern": ".* - vim", "field": "title",
+#        "icon": "fa:code", "priority": 1}
+#     ],
+#     "default": "*"
+#   }
+#
+# "icons" works like WINDOW_ICONS and "rules" takes the arguments of exact(),
+# glob() and regex(), all of them optional.  Each icon is passed through
+# 'resolve_icon', e.g. to look up font names.  Returns a (rules, default icon)
+# pair, with None for a missing default.  Raises OSError if the file can't be
+# read and ValueError if it isn't valid.
+def load_config(path, resolve_icon=lambda icon: icon):
+    with open(path) as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError('%s: %s' % (path, e))
+    if not isinstance(config, dict):
+        raise ValueError('%s: expected a JSON object' % path)
+
+    rules = []
+    for rule in config.get('rules', []):
+        try:
+            kind = {'exact': exact, 'glob': glob, 'regex': regex}[rule['kind']]
+            rules.append(
+                kind(rule['pattern'], resolve_icon(rule['icon']),
+                     rule.get('field', 'any'), rule.get('priority', 0)))
+        except (KeyError, TypeError):
+            raise ValueError('%s: invalid rule %r' % (path, rule))
+    icons = {
+        name: resolve_icon(icon)
+        for name, icon in config.get('icons', {}).items()
+    }
+    rules += rules_from_dict(icons)
+    default = config.get('default')
+    return rules, resolve_icon(default) if default is not None else None
+
+
+class IconMatcher:
+    def __init__(self, rules, default_icon='*', cache_size=4096):
+        self.default_icon = default_icon
+        self.rules = list(rules)
+        self.uses_titles = any(r.field == 'title' for r in self.rules)
+
+        # field -> lowercased value -> (sort key, icon)
+        self._exact = {field: {} for field in FIELDS}
+        # field -> [(sort key, compiled pattern, icon)], best first
+        self._patterns = {field: [] for field in FIELDS}
+        for order, rule in enumerate(self.rules):
+            if rule.field == 'any':
+                fields = ['instance', 'class']
+            elif rule.field in FIELDS:
+                fields = [rule.field]
+            else:
+                raise ValueError('Unknown icon rule field: %s' % rule.field)
+            if rule.kind == 'exact':
+                pattern = None
+            elif rule.kind == 'glob':
+                pattern = re.compile(fnmatch.translate(rule.pattern),
+                                     re.IGNORECASE)
+            elif rule.kind == 'regex':
+                pattern = re.compile(rule.pattern, re.IGNORECASE)
+            else:
+                raise ValueError('Unknown icon rule kind: %s' % rule.kind)
+
+            for field in fields:
+                # lower sort keys win
+                key = (-rule.priority, 0 if pattern is None else 1,
+                       FIELDS.index(field), order)
+                if pattern is None:
+                    self._exact[field].setdefault(rule.pattern.lower(),
+                                                  (key, rule.icon))
+                else:
+                    self._patterns[field].append((key, pattern, rule.icon))
+        for patterns in self._patterns.values():
+            patterns.sort(key=lambda p: p[0])
+
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self._lookup)
+
+    # Returns the icon for a window, or the default icon if no rule matches.
+    def icon(self, xclass, instance, title=''):
+        if not self.uses_titles:
+            title = ''
+        return self.lookup((xclass or '').lower(), (instance or '').lower(),
+                           (title or '').lower())
+
+    def _lookup(self, xclass, instance, title):
+        best = None
+        for field, value in zip(FIELDS, [instance, xclass, title]):
+            match = self._exact[field].get(value)
+            if match is not None and (best is None or match[0] < best[0]):
+                best = match
+            for key, pattern, icon in self._patterns[field]:
+                if best is not None and best[0] < key:
+                    break
+                if pattern.fullmatch(value):
+                    best = (key, icon)
+                    break
+
+        if best is None:
+            logging.info('No icon available for window with class: %s, '
+                         'instance: %s' % (xclass, instance))
+            return self.default_icon
+        return best[1]
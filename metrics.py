@@ -0,0 +1,203 @@
+# github.com/justbuchanan/i3scripts
+#
+# Counters and latency histograms for a long-running script, so that the cost
+# of handling each kind of i3 event can be measured in production instead of
+# guessed at.  autoname_workspaces.py keeps one Metrics object and reports it
+# on SIGUSR1 (to its log) and through the "stats" command of its control
+# socket (as JSON):
+#
+#   kill -USR1 $(pgrep -f autoname_workspaces.py)
+#   ./control.py stats
+#
+# What's tracked:
+# * per event type (e.g. 'window::new'): count, handling latency histogram and
+#   the i3 ipc round trips spent on it
+# * xprop subprocesses and window lookups
+# * rename commands issued and failed
+# * resident memory, sampled periodically
+
+import bisect
+import collections
+import os
+import threading
+import time
+
+# Upper bounds of the latency buckets, in milliseconds.  The last bucket holds
+# everything slower.
+BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+class Histogram:
+    def __init__(self, bounds=BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    # An estimate of the given percentile (0-100): the upper bound of the bucket
+    # it falls in, or the maximum for the last bucket.
+    def percentile(self, p):
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        labels = ['<=%g' % b for b in self.bounds] + ['>%g' % self.bounds[-1]]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': dict(zip(labels, self.counts)),
+        }
+
+
+# Resident memory of this process in KiB, or None if it can't be read.
+def resident_memory_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # the peak rather than the current value, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:
+        return None
+
+
+class Metrics:
+    def __init__(self, rss_samples=1440):
+        # Reentrant, since the signal handlers of autoname_workspaces.py (the
+        # SIGUSR1 dump and on_exit()) run on the main thread and may interrupt
+        # it while it holds the lock.
+        self._lock = threading.RLock()
+        self.started = time.time()
+        self.latency_ms = collections.defaultdict(Histogram)
+        self.ipc_by_event = collections.Counter()
+        self.ipc = 0
+        self.renames = 0
+        self.renames_failed = 0
+        # times the connection to i3 was re-established, e.g. after a restart
+        self.reconnects = 0
+        # (unix time, KiB) pairs, the oldest ones are dropped
+        self.rss = collections.deque(maxlen=rss_samples)
+
+    # Makes every message sent on the given i3 connection (an i3ipc.Connection,
+    # i3ipc.aio.Connection or util.LiteConnection) count as an ipc round trip.
+    # This wraps the private _message() of i3ipc 2.x connections; round trips
+    # on connections without it aren't counted.
+    def count_ipc(self, i3):
+        import inspect
+        message = getattr(i3, '_message', None)
+        if message is None:
+            return i3
+
+        def count():
+            with self._lock:
+                self.ipc += 1
+
+        if inspect.iscoroutinefunction(message):
+
+            async def counted(*args, **kwargs):
+                count()
+                return await message(*args, **kwargs)
+        else:
+
+            def counted(*args, **kwargs):
+                count()
+                return message(*args, **kwargs)
+
+        i3._message = counted
+        return i3
+
+    # Records the handling of one event of the given type (e.g. 'window::new')
+    # that arrived at 'start', a time.perf_counter() value, and cost 'ipc'
+    # round trips to i3.
+    def observe(self, event_type, start, ipc=0):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.latency_ms[event_type].observe(elapsed_ms)
+            self.ipc_by_event[event_type] += ipc
+
+    # Records the results of util.batch_rename_workspaces().
+    def renamed(self, results):
+        with self._lock:
+            self.renames += len(results)
+            self.renames_failed += results.count(False)
+
+    def sample_rss(self):
+        rss = resident_memory_kb()
+        if rss is not None:
+            with self._lock:
+                self.rss.append((int(time.time()), rss))
+
+    # Samples resident memory every 'interval' seconds from a daemon thread.
+    def start_sampling(self, interval=60):
+        def run():
+            while True:
+                self.sample_rss()
+                time.sleep(interval)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def as_dict(self):
+        from util import xprop_stats
+        self.sample_rss()
+        with self._lock:
+            events = {}
+            for event_type, hist in sorted(self.latency_ms.items()):
+                events[event_type] = hist.as_dict()
+                events[event_type]['ipc'] = self.ipc_by_event[event_type]
+                events[event_type]['ipc_per_event'] = (
+                    self.ipc_by_event[event_type] / hist.count)
+            return {
+                'uptime_s': int(time.time() - self.started),
+                'events': events,
+                'ipc': self.ipc,
+                'xprop': xprop_stats(),
+                'renames': self.renames,
+                'renames_failed': self.renames_failed,
+                'reconnects': self.reconnects,
+                'rss_kb': list(self.rss),
+            }
+
+    # A human readable version of as_dict().
+    def format(self):
+        d = self.as_dict()
+        lines = [
+            'uptime %ds, %d reconnects, %d ipc messages, %d renames '
+            '(%d failed), xprop: %s' %
+            (d['uptime_s'], d['reconnects'], d['ipc'], d['renames'],
+             d['renames_failed'], ', '.join('%s %s' % kv
+                                            for kv in d['xprop'].items())
+             or 'unused')
+        ]
+        lines.append('%-20s %8s %9s %9s %9s %9s %8s' %
+                     ('event', 'count', 'mean ms', 'p50 ms', 'p99 ms',
+                      'max ms', 'ipc/ev'))
+        for event_type, e in d['events'].items():
+            lines.append('%-20s %8d %9.2f %9.2f %9.2f %9.2f %8.2f' %
+                         (event_type, e['count'], e['mean'], e['p50'],
+                          e['p99'], e['max'], e['ipc_per_event']))
+        if d['rss_kb']:
+            rss = [kb for _, kb in d['rss_kb']]
+            lines.append('rss %d KiB (min %d, max %d over %d samples)' %
+                         (rss[-1], min(rss), max(rss), len(rss)))
+        return '\n'.join(lines)
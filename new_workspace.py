@@ -2,8 +2,6 @@
 #
 # github.com/justbuchanan/i3scripts
 
-import i3ipc
-import argparse
 import logging
 from util import *
 
@@ -11,7 +9,13 @@ from util import *
 # Finds the smallest workspace number such that it will open to the right of the
 # existing workspaces on the current monitor. For example if the current monitor
 # has workspace numbers [1,3,4], this function will return 5.
-def find_next_ws_num_on_monitor(i3):
+# If a util.WorkspaceIndex is given, it's used instead of querying i3.
+def find_next_ws_num_on_monitor(i3, index=None):
+    if index is not None:
+        focused_monitor = index.focused_workspace().output
+        maxnum = index.max_num_on_output(focused_monitor)
+        return maxnum + 1
+
     focused_monitor = focused_workspace(i3).output
     logging.info('focused monitor: %s' % focused_monitor)
 
@@ -24,9 +28,11 @@ def find_next_ws_num_on_monitor(i3):
     return maxnum + 1
 
 
-def new_workspace(move_focused=False):
-    i3 = i3ipc.Connection()
-    new_ws_num = find_next_ws_num_on_monitor(i3)
+# Jumps to a new workspace.  If no i3 connection (or util.I3Context) is given, a
+# new one is made.
+def new_workspace(move_focused=False, i3=None, index=None):
+    i3 = i3 or LiteConnection()
+    new_ws_num = find_next_ws_num_on_monitor(i3, index)
     if move_focused:
         # move focused window the next open workspace
         i3.command('move window to workspace number {0}; workspace {0}'.format(
@@ -36,6 +42,7 @@ def new_workspace(move_focused=False):
 
 
 if __name__ == '__main__':
+    import argparse
     parser = argparse.ArgumentParser(description="""
         Jump to a new workspace to the right of the existing ones on the current  monitor."""
                                      )
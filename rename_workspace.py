@@ -12,17 +12,27 @@
 #
 # Dependencies:
 # * zenity - install with system package manager
-# * i3ipc  - install with pip
 
-import i3ipc
 import logging
-import subprocess as proc
+import re
 import sys
 
 from util import *
 
 
+# Returns why 'shortname' can't be used, or None if it can.  A shortname has to
+# be a single word for parse_workspace_name() to find it again; an empty one
+# removes the shortname.
+def shortname_error(shortname):
+    if shortname and not re.fullmatch(r'\w+', shortname):
+        if ' ' in shortname:
+            return "No spaces allowed in workspace names"
+        return "Workspace names can only contain letters, digits and '_'"
+    return None
+
+
 def show_name_dialog(current_shortname):
+    import subprocess as proc
     try:
         # use zenity to show a text box asking the user for a new workspace name
         prompt_title = "Rename Workspace:" if current_shortname == None \
@@ -33,8 +43,8 @@ def show_name_dialog(current_shortname):
         logging.info("New name from user: '%s'" % new_shortname)
 
         # validate or fail
-        if ' ' in new_shortname:
-            msg = "No spaces allowed in workspace names"
+        msg = shortname_error(new_shortname)
+        if msg is not None:
             logging.error(msg)
             proc.check_call(['zenity', '--error', '--text=%s' % msg])
             sys.exit(1)
@@ -46,30 +56,41 @@ def show_name_dialog(current_shortname):
         sys.exit(1)
 
 
-# If new_shortname is None, shows a zenity dialog asking for a new name
-def rename_workspace(new_shortname=None):
+# If new_shortname is None, shows a zenity dialog asking for a new name.
+# If no i3 connection (or util.I3Context) is given, a new one is made.  If a
+# util.WorkspaceIndex is given, the focused workspace is read from it instead of
+# queried from i3.  Raises ValueError if new_shortname isn't a valid shortname
+# (see shortname_error()).
+def rename_workspace(new_shortname=None, i3=None, index=None):
     logging.basicConfig(level=logging.INFO)
+    if new_shortname is not None and shortname_error(new_shortname):
+        raise ValueError(shortname_error(new_shortname))
 
-    i3 = i3ipc.Connection()
-    workspace = focused_workspace(i3)
+    i3 = i3 or LiteConnection()
+    workspace = index.focused_workspace() if index else focused_workspace(i3)
     name_parts = parse_workspace_name(workspace.name)
     logging.info("Current workspace shortname: '%s'" % name_parts.shortname)
 
     # If name is not specified as a command line arg, ask the user.
     if new_shortname is None:
         new_shortname = show_name_dialog(name_parts.shortname)
+        # the user may have switched workspaces while the dialog was open
+        if isinstance(i3, I3Context):
+            i3.invalidate()
 
     # get the current workspace and rename it
     new_name = construct_workspace_name(
         NameParts(num=name_parts.num,
                   shortname=new_shortname,
                   icons=name_parts.icons))
-    workspace = focused_workspace(i3)
-    res = i3.command('rename workspace "%s" to "%s"' %
-                     (workspace.name, new_name))
-    assert res[0]['success'], "Failed to rename workspace"
+    workspace = index.focused_workspace() if index else focused_workspace(i3)
+    res = i3.command(rename_workspace_command(workspace.name, new_name))
+    assert res[0].success, "Failed to rename workspace"
 
 
 if __name__ == '__main__':
     new_shortname = sys.argv[1] if len(sys.argv) > 1 else None
-    rename_workspace(new_shortname)
+    try:
+        rename_workspace(new_shortname)
+    except ValueError as e:
+        sys.exit(str(e))
@@ -0,0 +1,151 @@
+# github.com/justbuchanan/i3scripts
+#
+# Remembers workspace shortnames across i3 sessions.  Shortnames (e.g. the
+# "web" of "1:web") set with rename_workspace.py or i3splat only live in i3's
+# workspace names, so they're gone once i3 exits.  autoname_workspaces.py
+# started with --shortnames keeps a ShortnameStore up to date from the
+# workspace renames it sees, and when it starts, it gives every workspace
+# without a shortname the one stored for its number and output, in the same
+# batched command as its first icon pass.  The shortname of a workspace that i3
+# removes (because it was left empty) is forgotten.
+#
+# The store is a small JSON file, by default
+# $XDG_STATE_HOME/i3scripts/shortnames.json:
+#
+#   {"v": 1, "outputs": {"DP-1": {"1": "web", "2": "code"}, "HDMI-1": {...}}}
+#
+# It's only written when a shortname changes, by replacing the whole file, so
+# it's never seen half-written.
+
+import json
+import logging
+import os
+
+from util import parse_workspace_name
+
+VERSION = 1
+
+
+def default_path():
+    state_dir = os.environ.get('XDG_STATE_HOME') or os.path.expanduser(
+        '~/.local/state')
+    return os.path.join(state_dir, 'i3scripts', 'shortnames.json')
+
+
+# The (number, shortname) of a workspace name, with None for missing parts.
+def _parse(name):
+    if not name[:1].isdigit():
+        return None, None
+    parts = parse_workspace_name(name)
+    return int(parts.num), parts.shortname
+
+
+class ShortnameStore:
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        # (output, number) -> shortname
+        self._names = self._load()
+        self._saved = dict(self._names)
+        # workspace con id -> ((output, number), shortname) as last seen
+        self._seen = {}
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            return {(output, int(num)): shortname
+                    for output, names in data['outputs'].items()
+                    for num, shortname in names.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError, AttributeError) as e:
+            logging.warning('Ignoring the shortname store %s: %s' %
+                            (self.path, e))
+            return {}
+
+    # Writes the store if it changed since it was last read or written.
+    def save(self):
+        if self._names == self._saved:
+            return
+        outputs = {}
+        for (output, num), shortname in sorted(self._names.items()):
+            outputs.setdefault(output, {})[str(num)] = shortname
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            data = {'v': VERSION, 'outputs': outputs}
+            with open(tmp, 'w') as f:
+                json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.warning('Unable to save shortnames to %s: %s' %
+                            (self.path, e))
+            return
+        self._saved = dict(self._names)
+
+    # The stored shortname for the workspace with the given number on the given
+    # output, or None.
+    def shortname(self, output, num):
+        return self._names.get((output, num))
+
+    # Records the name of a workspace.  A shortname that moved to another
+    # number (e.g. because the workspaces were renumbered) or that was removed
+    # is forgotten at its old number.
+    def _observe(self, ws_id, output, name):
+        num, shortname = _parse(name)
+        key = (output, num)
+        prev = self._seen.get(ws_id)
+        self._seen[ws_id] = (key, shortname)
+        if prev is not None and prev[1] is not None:
+            prev_key, prev_shortname = prev
+            if (prev_key != key or shortname is None
+                ) and self._names.get(prev_key) == prev_shortname:
+                del self._names[prev_key]
+        if num is not None and shortname is not None:
+            self._names[key] = shortname
+
+    # Takes the workspaces in the given i3tree layout tree, with the renames
+    # that were sent after it was fetched applied (as for
+    # workspace_state.WorkspaceState.update()), and saves any new shortnames.
+    # Workspaces that are new to the store are only taken as they are once
+    # they're renamed, so that a fresh session's unnamed workspaces don't
+    # overwrite the shortnames that are yet to be restored.
+    def update(self, tree, renames=(), results=()):
+        ids = {}
+        for ws in tree.workspaces():
+            output = ws.parent.parent.name
+            ids[ws.name] = ws.id, output
+            if ws.id in self._seen:
+                self._observe(ws.id, output, ws.name)
+            else:
+                num, shortname = _parse(ws.name)
+                self._seen[ws.id] = ((output, num), shortname)
+        for (old, new), ok in zip(renames, results):
+            if ok and old in ids:
+                ws_id, output = ids[new] = ids.pop(old)
+                self._observe(ws_id, output, new)
+        self.save()
+
+    # Records renames by others, e.g. rename_workspace.py, and forgets the
+    # shortnames of workspaces that i3 removed because they were left empty.
+    def handle_workspace_event(self, e):
+        con = e.current
+        if con is None:
+            return
+        if e.change == 'empty':
+            key, shortname = self._seen.pop(con.id, (None, None))
+            if shortname is not None and self._names.get(key) == shortname:
+                del self._names[key]
+                self.save()
+            return
+        if e.change != 'rename':
+            return
+        output = con.ipc_data.get('output')
+        if output is None:
+            # i3 versions before 4.10 don't report it
+            return
+        self._observe(con.id, output, con.name)
+        self.save()
+
+    def handle_output_event(self, e):
+        pass
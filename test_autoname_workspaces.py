@@ -0,0 +1,167 @@
+# github.com/justbuchanan/i3scripts
+#
+# Tests for the rename planning of autoname_workspaces.py, run against layout
+# trees built with fake_i3.  Run with:
+#
+#   python3 -m pytest
+
+import json
+
+import pytest
+
+import autoname_workspaces as autoname
+import fake_i3
+import i3tree
+import util
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(autoname, 'STATE', autoname.RenameState())
+    monkeypatch.setattr(autoname, 'WINDOW_CLASSES',
+                        autoname.WindowClassCache())
+
+
+def get_tree(fake):
+    return i3tree.parse_tree(json.dumps(fake.tree))
+
+
+# Applies renames to the fake, like util.batch_rename_workspaces().
+def apply(fake, renames):
+    if renames:
+        replies = fake.command('; '.join(
+            util.rename_workspace_command(old, new) for old, new in renames))
+        assert all(r['success'] for r in replies)
+
+
+def names(fake):
+    return [ws['name'] for ws in fake.workspaces()]
+
+
+# A fake with two workspaces: the first holds a kitty window and a split
+# container with two firefox windows, the second a single kitty window.
+def fake_with_split():
+    fake = fake_i3.FakeI3()
+    output = fake.add_output('DP-1')
+    first = fake._add_workspace(output, '1')
+    second = fake._add_workspace(output, '2')
+    fake._add_window(first, 'kitty', 'kitty')
+    split = fake._node('', 'con', output='DP-1', layout='splitv')
+    fake._add_window(split, 'firefox', 'Navigator')
+    fake._add_window(split, 'firefox', 'Navigator')
+    first['nodes'].append(split)
+    fake._add_window(second, 'kitty', 'kitty')
+    return fake, first, second, split
+
+
+def test_full_pass_renumbers_and_adds_icons():
+    fake = fake_i3.FakeI3.synthetic(outputs=2, workspaces=2, windows=1)
+    tree = get_tree(fake)
+    apply(fake, autoname.plan_renames(tree))
+    nums = [util.parse_workspace_name(name).num for name in names(fake)]
+    assert nums == ['1', '2', '4', '5']
+    assert all(util.parse_workspace_name(name).icons for name in names(fake))
+    # nothing left to do
+    assert autoname.plan_renames(get_tree(fake)) == []
+
+
+def test_incremental_pass_matches_full_pass_for_window_move():
+    fake, first, second, split = fake_with_split()
+    apply(fake, autoname.plan_renames(get_tree(fake)))
+
+    window = first['nodes'][0]
+    first['nodes'].remove(window)
+    second['nodes'].append(window)
+    tree = get_tree(fake)
+    renames = autoname.plan_renames_for_windows(tree,
+                                                [tree.find_by_id(window['id'])])
+    assert {old for old, _ in renames} == set(names(fake))
+    apply(fake, renames)
+    assert autoname.plan_renames(get_tree(fake)) == []
+
+
+def test_incremental_pass_matches_full_pass_for_container_move():
+    fake, first, second, split = fake_with_split()
+    apply(fake, autoname.plan_renames(get_tree(fake)))
+    firefox = autoname.icon_for_window(get_tree(fake).find_by_id(
+        split['nodes'][0]['id']))
+    assert firefox in names(fake)[0]
+
+    first['nodes'].remove(split)
+    second['nodes'].append(split)
+    tree = get_tree(fake)
+    renames = autoname.plan_renames_for_windows(tree,
+                                                [tree.find_by_id(split['id'])])
+    # the workspace the windows left needs new icons too
+    assert {old for old, _ in renames} == set(names(fake))
+    apply(fake, renames)
+    assert firefox not in names(fake)[0]
+    assert autoname.plan_renames(get_tree(fake)) == []
+
+
+def test_incremental_pass_falls_back_when_workspaces_change():
+    fake, first, second, split = fake_with_split()
+    apply(fake, autoname.plan_renames(get_tree(fake)))
+
+    third = fake._add_workspace(fake.outputs()[0], '7')
+    window = fake._add_window(third, 'kitty', 'kitty')
+    tree = get_tree(fake)
+    renames = autoname.plan_renames_for_windows(tree,
+                                                [tree.find_by_id(window['id'])])
+    # renumbered to follow the others
+    assert [new.split(':')[0] for _, new in renames] == ['3']
+
+
+# A steady stream of events, closer together than the coalescing window, must
+# still be handled within 'max_latency' of the first held event.
+def test_coalescer_bounds_latency_of_a_steady_stream():
+    import asyncio
+    import time
+
+    latencies = []
+    arrivals = {}
+
+    async def handler(events):
+        now = time.monotonic()
+        latencies.append(now - min(arrivals[e] for e in events))
+        # events keep arriving while a pass runs
+        await asyncio.sleep(0.03)
+
+    async def main():
+        coalescer = autoname.EventCoalescer(handler,
+                                            window=0.02,
+                                            max_latency=0.05)
+        worker = asyncio.ensure_future(coalescer.run())
+        for i in range(60):
+            arrivals[i] = time.monotonic()
+            coalescer.push(i)
+            await asyncio.sleep(0.005)
+        await asyncio.sleep(0.1)
+        worker.cancel()
+
+    asyncio.run(main())
+    assert len(latencies) > 2
+    assert max(latencies) < 0.05 + 0.015
+
+
+def test_coalescer_survives_a_failing_pass():
+    import asyncio
+
+    batches = []
+
+    async def handler(events):
+        batches.append(events)
+        if len(batches) == 1:
+            raise ConnectionError('lost i3')
+
+    async def main():
+        coalescer = autoname.EventCoalescer(handler, window=0.01)
+        worker = asyncio.ensure_future(coalescer.run())
+        coalescer.push('a')
+        await asyncio.sleep(0.05)
+        coalescer.push('b')
+        await asyncio.sleep(0.05)
+        worker.cancel()
+
+    asyncio.run(main())
+    assert batches == [['a'], ['b']]
@@ -0,0 +1,72 @@
+# github.com/justbuchanan/i3scripts
+#
+# Tests for icon_rules.IconMatcher.  Run with:
+#
+#   python3 -m pytest
+
+import pytest
+
+from icon_rules import IconMatcher, exact, glob, regex, rules_from_dict
+
+
+def test_exact_rules_ignore_case():
+    matcher = IconMatcher(rules_from_dict({'firefox': 'F'}), default_icon='?')
+    assert matcher.icon('Firefox', 'Navigator') == 'F'
+    assert matcher.icon('kitty', 'kitty') == '?'
+
+
+def test_instance_wins_over_class():
+    # the order the baseline looked up WM_CLASS values in, whatever the order
+    # of the dict
+    matcher = IconMatcher(rules_from_dict({'firefox': 'F', 'navigator': 'N'}))
+    assert matcher.icon('firefox', 'navigator') == 'N'
+    matcher = IconMatcher(rules_from_dict({'navigator': 'N', 'firefox': 'F'}))
+    assert matcher.icon('firefox', 'navigator') == 'N'
+
+
+def test_earlier_rule_wins_for_the_same_field():
+    matcher = IconMatcher([exact('firefox', 'A'), exact('firefox', 'B')])
+    assert matcher.icon('firefox', 'x') == 'A'
+
+
+def test_priority_beats_exact_and_field():
+    matcher = IconMatcher([
+        exact('navigator', 'N'),
+        glob('fire*', 'F', field='class', priority=1),
+    ])
+    assert matcher.icon('firefox', 'navigator') == 'F'
+
+
+def test_exact_beats_pattern_at_the_same_priority():
+    matcher = IconMatcher([glob('fire*', 'G'), exact('firefox', 'E')])
+    assert matcher.icon('firefox', 'x') == 'E'
+
+
+def test_patterns_match_the_whole_field():
+    matcher = IconMatcher([regex('fire', 'F', field='class')], '?')
+    assert matcher.icon('firefox', 'x') == '?'
+    assert matcher.icon('fire', 'x') == 'F'
+
+
+def test_patterns_only_match_their_field():
+    matcher = IconMatcher([glob('*vim*', 'V', field='title')], '?')
+    assert matcher.icon('kitty', 'vim', 'bash') == '?'
+    assert matcher.icon('kitty', 'kitty', 'notes - vim') == 'V'
+
+
+@pytest.mark.parametrize('pattern', [
+    '^firefox$',
+    '(?i)FIREFOX',
+    '(?P<r0>fire)fox',
+    'fire(fox|bird)',
+])
+def test_regex_keeps_its_usual_meaning(pattern):
+    matcher = IconMatcher([regex(pattern, 'F', field='class')], '?')
+    assert matcher.icon('Firefox', 'navigator') == 'F'
+    assert matcher.icon('kitty', 'firefox') == '?'
+
+
+def test_invalid_regex_fails_early():
+    import re
+    with pytest.raises(re.error):
+        IconMatcher([regex('(', 'X')])
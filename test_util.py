@@ -0,0 +1,73 @@
+# github.com/justbuchanan/i3scripts
+#
+# Tests for the workspace rename helpers in util.py, run against fake_i3.  Run
+# with:
+#
+#   python3 -m pytest
+
+import fake_i3
+import util
+
+
+# A fake with one workspace per name, all on one output.
+def fake_with(names):
+    fake = fake_i3.FakeI3()
+    output = fake.add_output('DP-1')
+    for name in names:
+        fake._add_workspace(output, name)
+    return fake
+
+
+# Runs a plan on the fake the way util.batch_rename_workspaces() sends it, as
+# a single command, and returns the workspace names afterwards.
+def run(fake, plan):
+    replies = fake.command('; '.join(
+        util.rename_workspace_command(old, new) for old, new in plan.renames))
+    assert all(r['success'] for r in replies), replies
+    return sorted(ws['name'] for ws in fake.workspaces())
+
+
+def test_chain_runs_from_its_far_end():
+    plan = util.plan_rename_order([('1', '2'), ('2', '3')])
+    assert plan.renames == [('2', '3'), ('1', '2')]
+    assert plan.cycles == 0
+    assert run(fake_with(['1', '2']), plan) == ['2', '3']
+
+
+def test_swap_uses_one_temporary_name():
+    plan = util.plan_rename_order([('1:a', '1:b'), ('1:b', '1:a')])
+    assert plan.cycles == 1
+    assert plan.cost == 3
+    fake = fake_with(['1:a', '1:b'])
+    ids = {ws['name']: ws['id'] for ws in fake.workspaces()}
+    assert run(fake, plan) == ['1:a', '1:b']
+    swapped = {ws['name']: ws['id'] for ws in fake.workspaces()}
+    assert swapped == {'1:a': ids['1:b'], '1:b': ids['1:a']}
+
+
+def test_temporary_names_are_accepted_by_i3():
+    plan = util.plan_rename_order([('1', '2'), ('2', '3'), ('3', '1'),
+                                   ('5', '6'), ('6', '5')])
+    assert plan.cycles == 2
+    for old, new in plan.renames:
+        assert not new.startswith('__')
+        assert util.parse_workspace_name(new).num is not None
+    assert run(fake_with(['1', '2', '3', '5', '6']),
+               plan) == ['1', '2', '3', '5', '6']
+
+
+def test_temporary_name_avoids_names_in_the_plan():
+    taken = str(util.TEMP_WORKSPACE_NUM + 1)
+    plan = util.plan_rename_order([('1', taken), (taken, '1')])
+    temps = {new for _, new in plan.renames} - {'1', taken}
+    assert temps == {str(util.TEMP_WORKSPACE_NUM + 2)}
+
+
+def test_unchanged_names_are_dropped():
+    assert util.plan_rename_order([('1', '1')]).renames == []
+
+
+def test_fake_refuses_internal_names():
+    fake = fake_with(['1'])
+    reply = fake.command('rename workspace "1" to "__x"')
+    assert not reply[0]['success']
@@ -0,0 +1,60 @@
+# github.com/justbuchanan/i3scripts
+#
+# Tests for streaming the workspace state to clients.  Run with:
+#
+#   python3 -m pytest
+
+import json
+import socket
+import threading
+import time
+
+import workspace_state
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def connect(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    # like read_states(), the client never writes
+    sock.shutdown(socket.SHUT_WR)
+    return sock, sock.makefile('r', encoding='utf-8')
+
+
+def publish(state, data):
+    with state._changed:
+        state._line = json.dumps(data)
+        state.version += 1
+        state._changed.notify_all()
+
+
+def test_clients_that_disconnect_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(workspace_state, 'CLIENT_CHECK_INTERVAL', 0.05)
+    state = workspace_state.WorkspaceState()
+    publish(state, {'outputs': []})
+    server = workspace_state.start_server(state, str(tmp_path / 'state.sock'))
+    try:
+        before = threading.active_count()
+        clients = [connect(str(tmp_path / 'state.sock')) for _ in range(3)]
+        for _, lines in clients:
+            assert json.loads(lines.readline()) == {'outputs': []}
+        assert wait_until(lambda: threading.active_count() == before + 3)
+
+        for sock, lines in clients[:2]:
+            lines.close()
+            sock.close()
+        # dropped without waiting for the state to change
+        assert wait_until(lambda: threading.active_count() == before + 1)
+
+        publish(state, {'outputs': [{'name': 'DP-1', 'workspaces': []}]})
+        assert json.loads(clients[2][1].readline())['outputs'][0]['name'] \
+            == 'DP-1'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -1,18 +1,296 @@
 # github.com/justbuchanan/i3scripts
 
+import abc
+import bisect
+import functools
+import os
 import re
 import logging
-import subprocess as proc
 from collections import namedtuple, Counter
+from types import SimpleNamespace
 
 # A type that represents a parsed workspace "name".
 NameParts = namedtuple('NameParts', ['num', 'shortname', 'icons'])
 
 
+# A minimal i3 ipc client for the short-lived scripts that are run from key
+# bindings.  Importing i3ipc (and the Xlib it pulls in) takes several times
+# longer than everything else these scripts do, and all they need is
+# get_workspaces() and command().  Replies are returned as objects with the same
+# attributes as i3ipc's.
+class LiteConnection:
+    _MAGIC = b'i3-ipc'
+    _HEADER = '=6sII'
+    COMMAND = 0
+    GET_WORKSPACES = 1
+    SUBSCRIBE = 2
+    GET_TREE = 4
+    SEND_TICK = 10
+    EVENTS = [
+        'workspace', 'output', 'mode', 'window', 'barconfig_update', 'binding',
+        'shutdown', 'tick'
+    ]
+
+    def __init__(self, socket_path=None):
+        import socket
+        self.socket_path = socket_path or find_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.socket_path)
+        self._events = []
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError('i3 closed the ipc connection')
+            data += chunk
+        return data
+
+    # Reads one message, returning its type and decoded payload.
+    def _read(self):
+        import json
+        import struct
+        header = self._recv(struct.calcsize(self._HEADER))
+        _, length, msg_type = struct.unpack(self._HEADER, header)
+        return msg_type, json.loads(self._recv(length))
+
+    def _message(self, msg_type, payload=''):
+        import struct
+        payload = payload.encode('utf-8')
+        self._sock.sendall(
+            struct.pack(self._HEADER, self._MAGIC, len(payload), msg_type) +
+            payload)
+        while True:
+            reply_type, data = self._read()
+            if not reply_type & (1 << 31):
+                return data
+            # an event for a subscribed connection, keep it for read_event()
+            self._events.append((self.EVENTS[reply_type & 0x7f], data))
+
+    def command(self, payload):
+        return [
+            SimpleNamespace(success=r.get('success', False),
+                            error=r.get('error'),
+                            ipc_data=r)
+            for r in self._message(self.COMMAND, payload)
+        ]
+
+    def get_workspaces(self):
+        return [
+            SimpleNamespace(ipc_data=w, **w)
+            for w in self._message(self.GET_WORKSPACES)
+        ]
+
+    # Returns the layout tree as the plain dict i3 sends, without wrapping each
+    # node in an object.
+    def get_tree(self):
+        return self._message(self.GET_TREE)
+
+    # Sends a tick event with the given payload to every client subscribed to
+    # ticks.
+    def send_tick(self, payload=''):
+        return self._message(self.SEND_TICK, payload)['success']
+
+    # Subscribes this connection to a list of event types, e.g. ['window'].
+    def subscribe(self, events):
+        import json
+        return self._message(self.SUBSCRIBE, json.dumps(events))['success']
+
+    # Waits for the next event on a subscribed connection.  Returns an (event
+    # type, payload dict) pair, or None if nothing arrived within 'timeout'
+    # seconds.
+    def read_event(self, timeout=None):
+        import select
+        if self._events:
+            return self._events.pop(0)
+        while True:
+            ready, _, _ = select.select([self._sock], [], [], timeout)
+            if not ready:
+                return None
+            msg_type, data = self._read()
+            if msg_type & (1 << 31):
+                return self.EVENTS[msg_type & 0x7f], data
+
+    def close(self):
+        self._sock.close()
+
+
+# One i3 connection shared by a sequence of script calls, e.g.
+#
+#   with I3Context() as i3:
+#       new_workspace(i3=i3)
+#       rename_workspace('code', i3=i3)
+#
+# It can be passed anywhere a connection is expected.  get_workspaces() is
+# answered from a snapshot that is taken on first use and dropped by the next
+# command, so reads between two commands cost a single query.  'i3' can be an
+# existing connection (a LiteConnection or i3ipc.Connection) to wrap; by
+# default a LiteConnection is made.
+class I3Context:
+    def __init__(self, i3=None, socket_path=None):
+        self._owned = i3 is None
+        self.i3 = i3 or LiteConnection(socket_path)
+        self._workspaces = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Drops the workspace snapshot, for changes made behind this context's
+    # back (e.g. by the user while a dialog was open).
+    def invalidate(self):
+        self._workspaces = None
+
+    def get_workspaces(self):
+        if self._workspaces is None:
+            self._workspaces = self.i3.get_workspaces()
+        return self._workspaces
+
+    def get_tree(self):
+        return self.i3.get_tree()
+
+    def command(self, payload):
+        self.invalidate()
+        return self.i3.command(payload)
+
+    def close(self):
+        if self._owned:
+            self.i3.close()
+
+
+# Finds the i3 ipc socket, like i3ipc does.
+def find_socket_path():
+    path = os.environ.get('I3SOCK')
+    if path:
+        return path
+    import subprocess as proc
+    return proc.check_output(['i3', '--get-socketpath']).decode('utf-8').strip()
+
+
+# Works with a connection or an I3Context, which answers from its snapshot.
 def focused_workspace(i3):
     return [w for w in i3.get_workspaces() if w.focused][0]
 
 
+# An in-memory model of the workspaces on each output and which one is focused,
+# kept up to date from i3's workspace and output events instead of being queried
+# each time.  Feed it events with handle_workspace_event() and
+# handle_output_event(); it goes back to i3 (with the connection it was created
+# with) only when it's first used and after events it can't apply on its own,
+# like a reload or an output change.  All methods are thread-safe, so a daemon
+# can update it from its event loop and read from it elsewhere.
+class WorkspaceIndex:
+    def __init__(self, i3):
+        import threading
+        self._i3 = i3
+        self._lock = threading.RLock()
+        self._stale = True
+        # workspace id -> SimpleNamespace(id, name, num, output, focused)
+        self._workspaces = {}
+        # output name -> sorted list of workspace numbers
+        self._nums = {}
+        self._focused = None
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def sync(self):
+        with self._lock:
+            self._workspaces.clear()
+            self._nums.clear()
+            self._focused = None
+            self._stale = False
+            for w in self._i3.get_workspaces():
+                # Workspaces are keyed by container id, like in events.  i3
+                # only reports them here since 4.18; without them the index
+                # falls back to querying i3 on every read.
+                ws_id = w.ipc_data.get('id')
+                self._stale = ws_id is None
+                self._add(ws_id or w.name, w.name, w.num, w.output)
+                if w.focused:
+                    self._focused = ws_id or w.name
+
+    def _ensure_synced(self):
+        if self._stale:
+            self.sync()
+
+    def _add(self, ws_id, name, num, output):
+        self._workspaces[ws_id] = SimpleNamespace(id=ws_id,
+                                                  name=name,
+                                                  num=num,
+                                                  output=output,
+                                                  focused=False)
+        bisect.insort(self._nums.setdefault(output, []), num)
+
+    def _remove(self, ws_id):
+        ws = self._workspaces.pop(ws_id, None)
+        if ws is not None:
+            nums = self._nums[ws.output]
+            del nums[bisect.bisect_left(nums, ws.num)]
+            if self._focused == ws_id:
+                self._focused = None
+        return ws
+
+    def handle_workspace_event(self, e):
+        with self._lock:
+            if self._stale or e.change in ['reload', 'restart']:
+                self._stale = True
+                return
+            con = e.current
+            if e.change == 'empty':
+                self._remove(con.id)
+            elif e.change in ['init', 'rename', 'move']:
+                self._remove(con.id)
+                output = con.ipc_data.get('output')
+                if output is None:
+                    # i3 versions before 4.10 don't report it
+                    self._stale = True
+                    return
+                self._add(con.id, con.name, con.num, output)
+                if con.focused:
+                    self._focused = con.id
+            elif e.change == 'focus':
+                if con.id not in self._workspaces:
+                    self._stale = True
+                    return
+                self._focused = con.id
+
+    def handle_output_event(self, e):
+        self.invalidate()
+
+    # Returns the focused workspace, with the same attributes as an entry of
+    # i3.get_workspaces().
+    def focused_workspace(self):
+        with self._lock:
+            self._ensure_synced()
+            if self._focused not in self._workspaces:
+                self.sync()
+            ws = self._workspaces[self._focused]
+            return SimpleNamespace(id=ws.id,
+                                   name=ws.name,
+                                   num=ws.num,
+                                   output=ws.output,
+                                   focused=True)
+
+    # Returns the sorted workspace numbers on the given output.
+    def nums_on_output(self, output):
+        with self._lock:
+            self._ensure_synced()
+            return list(self._nums.get(output, []))
+
+    # Returns the largest workspace number on the given output, or None if it
+    # has no workspaces.
+    def max_num_on_output(self, output):
+        with self._lock:
+            self._ensure_synced()
+            nums = self._nums.get(output)
+            return nums[-1] if nums else None
+
+
 # Takes a workspace 'name' from i3 and splits it into three parts:
 # * 'num'
 # * 'shortname' - the workspace's name, assumed to have no spaces
@@ -40,17 +318,288 @@ def construct_workspace_name(parts):
     return new_name
 
 
-# Return an array of values for the X property on the given window.
-# Requires xorg-xprop to be installed.
-def xprop(win_id, property):
-    try:
-        prop = proc.check_output(
-            ['xprop', '-id', str(win_id), property], stderr=proc.DEVNULL)
+# Returns the i3 command that renames workspace 'old_name' to 'new_name'.
+def rename_workspace_command(old_name, new_name):
+    return 'rename workspace %s to %s' % (quote_workspace_name(old_name),
+                                          quote_workspace_name(new_name))
+
+
+# Quotes a workspace name for use in an i3 command.
+def quote_workspace_name(name):
+    return '"%s"' % name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+# An ordered list of (old_name, new_name) renames, as made by
+# plan_rename_order().  'cost' is the number of rename commands it takes and
+# 'cycles' the number of them that needed a temporary name.
+class RenamePlan:
+    def __init__(self, renames, cycles=0):
+        self.renames = renames
+        self.cycles = cycles
+
+    @property
+    def cost(self):
+        return len(self.renames)
+
+
+# The first temporary name used by plan_rename_order().  i3 refuses names
+# starting with '__', and a plain number parses like any workspace name.
+TEMP_WORKSPACE_NUM = 1000000
+
+
+# Orders a set of workspace renames so that none of them targets a name that
+# another workspace still has at that point, which i3 would refuse.  Renames
+# that wait on each other form chains (renaming 1 -> 2 has to wait for 2 -> 3),
+# which are run from their far end.  Only a cycle (1 -> 2 and 2 -> 1) can't be
+# ordered; it's broken by moving one workspace to a temporary name (a number
+# from TEMP_WORKSPACE_NUM up) first, at the cost of one extra command per
+# cycle.  Renames that don't change the name are dropped.  Returns a
+# RenamePlan.
+def plan_rename_order(renames):
+    renames = [(old, new) for old, new in renames if old != new]
+    new_names = dict(renames)
+    taken = set(new_names) | set(new_names.values())
+
+    ordered = []
+    cycles = 0
+    done = set()
+    for start, _ in renames:
+        if start in done:
+            continue
+        # Follow the chain of renames whose targets are still taken.
+        path = [start]
+        while (new_names[path[-1]] in new_names
+               and new_names[path[-1]] not in done
+               and new_names[path[-1]] != start):
+            path.append(new_names[path[-1]])
+        done.update(path)
+
+        if new_names[path[-1]] != start:
+            ordered += [(old, new_names[old]) for old in reversed(path)]
+            continue
+
+        cycles += 1
+        num = TEMP_WORKSPACE_NUM + cycles
+        while str(num) in taken:
+            num += 1
+        temp = str(num)
+        ordered.append((start, temp))
+        ordered += [(old, new_names[old]) for old in reversed(path[1:])]
+        ordered.append((temp, new_names[start]))
+
+    return RenamePlan(ordered, cycles)
+
+
+def _batch_rename_command(renames):
+    return '; '.join(rename_workspace_command(old, new) for old, new in renames)
+
+
+def _batch_rename_results(renames, replies):
+    return [
+        i < len(replies) and replies[i].success for i in range(len(renames))
+    ]
+
+
+def _log_rename_failure(old, new):
+    logging.warning("Unable to rename workspace '%s' to '%s'" % (old, new))
+
+
+# Applies a list of (old_name, new_name) workspace renames with a single IPC
+# message, so a renumbering cascade costs one round trip (and one i3bar redraw)
+# instead of one per workspace.  i3 runs the ';'-separated commands in order
+# and reports a result for each, so any rename that failed (e.g. because its
+# new name was still taken at that point) is retried on its own afterwards.
+# Returns a list of booleans indicating which renames succeeded.
+def batch_rename_workspaces(i3, renames):
+    if not renames:
+        return []
+
+    results = _batch_rename_results(
+        renames, i3.command(_batch_rename_command(renames)))
+    for i, (old, new) in enumerate(renames):
+        if not results[i]:
+            results[i] = _batch_rename_results(
+                [(old, new)], i3.command(rename_workspace_command(old,
+                                                                  new)))[0]
+            if not results[i]:
+                _log_rename_failure(old, new)
+
+    return results
+
+
+# Same as batch_rename_workspaces(), for an i3ipc.aio connection.
+async def batch_rename_workspaces_async(i3, renames):
+    if not renames:
+        return []
+
+    results = _batch_rename_results(
+        renames, await i3.command(_batch_rename_command(renames)))
+    for i, (old, new) in enumerate(renames):
+        if not results[i]:
+            results[i] = _batch_rename_results(
+                [(old, new)], await
+                i3.command(rename_workspace_command(old, new)))[0]
+            if not results[i]:
+                _log_rename_failure(old, new)
+
+    return results
+
+
+# Reads X window properties by running the xprop binary once per window.
+# Requires xorg-xprop to be installed.  Pass a display name to use something
+# other than $DISPLAY.
+class SubprocessXprop:
+    def __init__(self, display_name=None):
+        self.display_name = display_name
+        self.forks = 0
+        self.lookups = 0
+
+    def get(self, win_id, property):
+        import subprocess as proc
+        try:
+            self.lookups += 1
+            self.forks += 1
+            display = (['-display', self.display_name]
+                       if self.display_name else [])
+            prop = proc.check_output(['xprop'] + display +
+                                     ['-id', str(win_id), property],
+                                     stderr=proc.DEVNULL)
+        except (proc.CalledProcessError, OSError) as e:
+            logging.warning("Unable to get property for window '%d'" % win_id)
+            return None
         prop = prop.decode('utf-8')
-        return re.findall('"([^"]*)"', prop)
-    except proc.CalledProcessError as e:
-        logging.warn("Unable to get property for window '%d'" % win_id)
-        return None
+        values = re.findall('"([^"]*)"', prop)
+        if not values and ' = ' in prop:
+            # numeric properties like _NET_WM_PID aren't quoted
+            values = [
+                int(v, 0) for v in re.findall(r'-?(?:0x[0-9a-f]+|\d+)',
+                                              prop.split(' = ', 1)[1])
+            ]
+        return values
+
+    def get_many(self, win_ids, property):
+        return {win_id: self.get(win_id, property) for win_id in win_ids}
+
+
+# Reads X window properties over a single, persistent connection to the X
+# server using python-xlib (already a dependency of i3ipc).  get_many() sends
+# the requests for all windows before waiting for any reply, so resolving a
+# property for a whole desktop costs one round trip instead of one process per
+# window.  Pass a display name (e.g. ':99' for an Xvfb server) to use something
+# other than $DISPLAY.
+class XlibXprop:
+    def __init__(self, display_name=None):
+        from Xlib import display
+        self._display = display.Display(display_name)
+        self._atoms = {}
+        self.lookups = 0
+
+    def _atom(self, name):
+        if name not in self._atoms:
+            self._atoms[name] = self._display.intern_atom(name)
+        return self._atoms[name]
+
+    def get(self, win_id, property):
+        return self.get_many([win_id], property)[win_id]
+
+    def get_many(self, win_ids, property):
+        from Xlib import X
+        from Xlib.error import XError
+        from Xlib.protocol import request
+
+        atom = self._atom(property)
+        self.lookups += len(win_ids)
+        pending = {
+            win_id: request.GetProperty(display=self._display.display,
+                                        defer=True,
+                                        delete=False,
+                                        window=win_id,
+                                        property=atom,
+                                        type=X.AnyPropertyType,
+                                        long_offset=0,
+                                        long_length=1024)
+            for win_id in win_ids
+        }
+        self._display.flush()
+
+        values = {}
+        for win_id, req in pending.items():
+            try:
+                req.reply()
+            except XError:
+                logging.warning("Unable to get property for window '%d'" %
+                                win_id)
+                values[win_id] = None
+                continue
+            if not req.property_type:
+                # the window doesn't have this property
+                values[win_id] = []
+                continue
+            fmt, value = req.value
+            if fmt == 8:
+                # null-separated strings, like WM_CLASS
+                value = value.decode('utf-8', 'replace')
+                values[win_id] = [v for v in value.split('\0') if v]
+            else:
+                values[win_id] = list(value)
+        return values
+
+
+_xprop_backend = None
+
+
+# Makes an xprop backend for the given X display ($DISPLAY by default): an
+# XlibXprop if it can connect to the X server, falling back to SubprocessXprop.
+# Set the I3SCRIPTS_XPROP environment variable to 'xlib' or 'subprocess' to
+# choose one.
+def new_xprop_backend(display_name=None):
+    if os.environ.get('I3SCRIPTS_XPROP', 'xlib') == 'xlib':
+        try:
+            return XlibXprop(display_name)
+        except Exception as e:
+            logging.info("Using the xprop binary, no X connection: %s" % e)
+    return SubprocessXprop(display_name)
+
+
+# Returns the backend used by xprop(), made by new_xprop_backend() on first
+# use.
+def xprop_backend():
+    global _xprop_backend
+    if _xprop_backend is None:
+        _xprop_backend = new_xprop_backend()
+    return _xprop_backend
+
+
+# Counters for the xprop backend, or an empty dict if it hasn't been used.
+def xprop_stats():
+    if _xprop_backend is None:
+        return {}
+    return {
+        'backend': type(_xprop_backend).__name__,
+        'lookups': _xprop_backend.lookups,
+        'forks': getattr(_xprop_backend, 'forks', 0),
+    }
+
+
+# Sets the backend used by xprop() and returns the previous one (None if there
+# wasn't one yet).
+def set_xprop_backend(backend):
+    global _xprop_backend
+    previous, _xprop_backend = _xprop_backend, backend
+    return previous
+
+
+# Return an array of values for the X property on the given window, or None if
+# it couldn't be read.  String properties are returned as strings, numeric ones
+# as ints.
+def xprop(win_id, property):
+    return xprop_backend().get(win_id, property)
+
+
+# Like xprop(), but for many windows at once.  Returns a dict of window id to
+# values.
+def xprop_many(win_ids, property):
+    return xprop_backend().get_many(list(win_ids), property)
 
 
 # Unicode subscript and superscript numbers
@@ -72,35 +621,98 @@ def _encode_base_10_number(n: int, symbols: str) -> str:
     return ''.join([symbols[int(digit)] for digit in str(n)])
 
 
-def format_icon_list(icon_list, icon_list_format='default'):
-    if icon_list_format.lower() == 'default':
-        # Default (no formatting)
-        return ' '.join(icon_list)
+# Formats the list of icons of a workspace.  Subclasses implement _format(),
+# which gets the icons as a tuple; calls are memoized per tuple, since the same
+# handful of combinations come up on every event.
+class IconListFormatter(abc.ABC):
+    def __init__(self, cache_size=1024):
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._format)
+
+    def __call__(self, icon_list):
+        return self._cached(tuple(icon_list))
+
+    @abc.abstractmethod
+    def _format(self, icons):
+        pass
 
-    elif icon_list_format.lower() == 'mathematician':
-        # Mathematician mode
-        # aababa -> a⁴b²
-        new_list = []
-        for icon, count in Counter(icon_list).items():
-            if count > 1:
-                new_list.append(icon +
-                                _encode_base_10_number(count, _superscript))
-            else:
-                new_list.append(icon)
-        return ' '.join(new_list)
 
-    elif icon_list_format.lower() == 'chemist':
-        # Chemist mode
-        # aababa -> a₄b₂
+# No formatting: a b a -> a b a
+class JoinFormatter(IconListFormatter):
+    def _format(self, icons):
+        return ' '.join(icons)
+
+
+# Each icon once, followed by its count in the given digits, in the order the
+# icons were first seen: aababa -> a⁴b²
+class CountFormatter(IconListFormatter):
+    def __init__(self, digits, cache_size=1024):
+        super().__init__(cache_size)
+        self.digits = digits
+
+    def _format(self, icons):
         new_list = []
-        for icon, count in Counter(icon_list).items():
+        for icon, count in Counter(icons).items():
             if count > 1:
                 new_list.append(icon +
-                                _encode_base_10_number(count, _subscript))
+                                _encode_base_10_number(count, self.digits))
             else:
                 new_list.append(icon)
         return ' '.join(new_list)
 
-    else:
-        raise ValueError("Unknown format name for the list of icons: ",
-                         icon_list_format)
+
+# At most 'limit' icons followed by '+k' for the k that didn't fit, optionally
+# with each icon only shown once (in the order they were first seen).
+class CapFormatter(IconListFormatter):
+    def __init__(self, limit=None, unique=False, cache_size=1024):
+        super().__init__(cache_size)
+        self.limit = limit
+        self.unique = unique
+
+    def _format(self, icons):
+        if self.unique:
+            icons = tuple(dict.fromkeys(icons))
+        if self.limit is None or len(icons) <= self.limit:
+            return ' '.join(icons)
+        return ' '.join(icons[:self.limit] +
+                        ('+%d' % (len(icons) - self.limit), ))
+
+
+# Formatters by the name used for them on the command line.  Names of the form
+# 'cap:N' and 'dedup:N' are made on demand by icon_list_formatter().
+ICON_LIST_FORMATS = {
+    # aababa -> a a b a b a
+    'default': JoinFormatter(),
+    # aababa -> a⁴b²
+    'mathematician': CountFormatter(_superscript),
+    # aababa -> a₄b₂
+    'chemist': CountFormatter(_subscript),
+    # aababa -> a b
+    'dedup': CapFormatter(unique=True),
+}
+
+
+def register_icon_list_format(name, formatter):
+    ICON_LIST_FORMATS[name.lower()] = formatter
+
+
+# Returns the formatter for a format name (see ICON_LIST_FORMATS), e.g.
+# 'chemist', 'cap:3' (aababa -> a a b +3) or 'dedup:1' (aababa -> a +1).
+# Resolve the name once and pass the formatter around instead of the name.
+def icon_list_formatter(name):
+    if isinstance(name, IconListFormatter):
+        return name
+    name = name.lower()
+    formatter = ICON_LIST_FORMATS.get(name)
+    if formatter is None:
+        kind, _, limit = name.partition(':')
+        if kind not in ['cap', 'dedup'] or not limit.isdigit():
+            raise ValueError("Unknown format name for the list of icons: %s" %
+                             name)
+        formatter = CapFormatter(int(limit), unique=kind == 'dedup')
+        register_icon_list_format(name, formatter)
+    return formatter
+
+
+# 'icon_list_format' can be a format name or an IconListFormatter.
+def format_icon_list(icon_list, icon_list_format='default'):
+    return icon_list_formatter(icon_list_format)(icon_list)
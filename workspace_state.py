@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+#
+# github.com/justbuchanan/i3scripts
+#
+# Streams the workspaces as autoname_workspaces.py sees them to status bars, so
+# that a bar block doesn't have to poll i3 and parse workspace names itself.
+# Started with --state_socket, autoname_workspaces.py writes one line of JSON to
+# every client of a unix socket when it connects and then each time something
+# changes.  The state comes from the layout trees and workspace events that the
+# script gets anyway, so any number of clients cost i3 nothing.
+#
+# Each line holds the workspaces of every output, in the order i3bar shows
+# them:
+#
+#   {"outputs": [{"name": "DP-1", "workspaces": [{"num": 1, "shortname": "web",
+#     "icons": " ", "name": "1:web  ", "focused": true,
+#     "visible": true, "urgent": false}, ...]}, ...]}
+#
+# When run as a script, this is a client that prints the stream, or only the
+# workspaces of one output with --output:
+#
+#   ./workspace_state.py --output DP-1
+#
+# or, without starting python at all:
+#
+#   socat -u UNIX-CONNECT:$XDG_RUNTIME_DIR/i3scripts-state.sock -
+#
+# A client that reads slower than the state changes skips the states in between
+# rather than holding up the script: it's always sent the latest one.
+
+import json
+import os
+import socket
+import sys
+import threading
+
+from util import parse_workspace_name
+
+# How often, in seconds, a client that's waiting for the state to change is
+# checked for having disconnected.
+CLIENT_CHECK_INTERVAL = 5.0
+
+
+# $I3SCRIPTS_STATE_SOCK, or a socket in the user's runtime directory.
+def default_socket_path():
+    if os.environ.get('I3SCRIPTS_STATE_SOCK'):
+        return os.environ['I3SCRIPTS_STATE_SOCK']
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'i3scripts-state.sock')
+    return '/tmp/i3scripts-state-%d.sock' % os.getuid()
+
+
+# The id of the focused workspace in an i3tree layout tree, found by following
+# the focus lists down from the root.  Falls back to looking for the focused
+# container when there aren't any.
+def _focused_workspace_id(tree):
+    con = tree
+    while con is not None and con.focus:
+        focus_id = con.focus[0]
+        con = next((c for c in con.nodes if c.id == focus_id), None)
+        if con is not None and con.type == 'workspace':
+            return con.id
+    focused = next((c for c in tree if c.focused), None)
+    workspace = focused.workspace() if focused is not None else None
+    return workspace.id if workspace is not None else None
+
+
+def _workspace_json(ws):
+    if ws['name'][:1].isdigit():
+        parts = parse_workspace_name(ws['name'])
+        num, shortname, icons = int(parts.num), parts.shortname, parts.icons
+    else:
+        num, shortname, icons = -1, ws['name'], None
+    return {
+        'num': num,
+        'shortname': shortname,
+        'icons': icons,
+        'name': ws['name'],
+        'focused': ws['focused'],
+        'visible': ws['visible'],
+        'urgent': ws['urgent'],
+    }
+
+
+# The workspaces of every output, kept up to date from layout trees, rename
+# results and workspace events.  Every change that shows in the JSON bumps
+# 'version' and wakes up the clients waiting in wait().
+class WorkspaceState:
+    def __init__(self):
+        self._changed = threading.Condition()
+        # output names in order
+        self._outputs = []
+        # workspace con id -> dict(name, output, focused, visible, urgent),
+        # in the order i3 has them
+        self._workspaces = {}
+        self._line = None
+        self.version = 0
+
+    # Replaces the state with what's in the given i3tree layout tree, then
+    # applies the (old_name, new_name) renames that were sent after it was
+    # fetched and succeeded, according to 'results' (see
+    # util.batch_rename_workspaces()).
+    def update(self, tree, renames=(), results=()):
+        focused = _focused_workspace_id(tree)
+        outputs = []
+        workspaces = {}
+        for output in tree.nodes:
+            if output.name.startswith('__'):
+                continue
+            outputs.append(output.name)
+            for con in output.nodes:
+                if con.type != 'con':
+                    # a dock area
+                    continue
+                visible = con.focus[0] if con.focus else focused
+                for ws in con.nodes:
+                    if ws.type != 'workspace' or ws.name.startswith('__'):
+                        continue
+                    workspaces[ws.id] = {
+                        'name': ws.name,
+                        'output': output.name,
+                        'focused': ws.id == focused,
+                        'visible': ws.id == visible,
+                        'urgent': ws.urgent,
+                    }
+
+        by_name = {ws['name']: ws for ws in workspaces.values()}
+        for (old, new), ok in zip(renames, results):
+            if ok and old in by_name:
+                by_name[new] = by_name.pop(old)
+                by_name[new]['name'] = new
+
+        with self._changed:
+            self._outputs = outputs
+            self._workspaces = workspaces
+            self._publish()
+
+    # Applies a workspace event (an i3ipc.WorkspaceEvent), covering the changes
+    # that don't come with a new layout tree: focus, urgency, workspaces
+    # created or removed by switching to or away from them, and renames by
+    # others.  Moves are left to the next update().
+    def handle_workspace_event(self, e):
+        con = e.current
+        if con is None:
+            return
+        with self._changed:
+            ws = self._workspaces.get(con.id)
+            if e.change == 'empty':
+                self._workspaces.pop(con.id, None)
+            elif e.change in ['init', 'focus'] and ws is None:
+                output = con.ipc_data.get('output')
+                if output is None:
+                    # i3 versions before 4.10 don't report it
+                    return
+                if output not in self._outputs:
+                    self._outputs.append(output)
+                ws = self._workspaces[con.id] = {
+                    'name': con.name,
+                    'output': output,
+                    'focused': False,
+                    'visible': False,
+                    'urgent': bool(con.urgent),
+                }
+            if ws is None:
+                return
+            if e.change == 'focus':
+                for other in self._workspaces.values():
+                    other['focused'] = other is ws
+                    if other['output'] == ws['output']:
+                        other['visible'] = other is ws
+            elif e.change == 'rename':
+                ws['name'] = con.name
+            elif e.change == 'urgent':
+                ws['urgent'] = bool(con.urgent)
+            self._publish()
+
+    # Outputs that appear or go away are picked up by the next update(), since
+    # their workspaces move and get renumbered.
+    def handle_output_event(self, e):
+        pass
+
+    # Called with self._changed held.
+    def _publish(self):
+        line = json.dumps(self.as_dict(), ensure_ascii=False)
+        if line != self._line:
+            self._line = line
+            self.version += 1
+            self._changed.notify_all()
+
+    def as_dict(self):
+        outputs = {name: [] for name in self._outputs}
+        for ws in self._workspaces.values():
+            outputs.setdefault(ws['output'], []).append(_workspace_json(ws))
+        for workspaces in outputs.values():
+            # the order of i3bar: numbered workspaces first, by number
+            workspaces.sort(key=lambda ws: (ws['num'] < 0, ws['num']))
+        return {
+            'outputs': [{
+                'name': name,
+                'workspaces': workspaces
+            } for name, workspaces in outputs.items()]
+        }
+
+    # Waits until the version differs from 'version', or for at most 'timeout'
+    # seconds, and returns the current version and its JSON line.
+    def wait(self, version, timeout=None):
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version, self._line
+
+
+# Whether the other end of a connected socket has closed it.  Clients that only
+# shut down their writing side (like read_states()) are still there.
+def _hung_up(sock):
+    import select
+    poll = select.poll()
+    poll.register(sock, select.POLLHUP | select.POLLERR)
+    return any(events & (select.POLLHUP | select.POLLERR | select.POLLNVAL)
+               for _, events in poll.poll(0))
+
+
+# Starts streaming the given WorkspaceState on a unix socket from a background
+# thread.  Returns the server; call shutdown() and server_close() on it to stop.
+def start_server(state, socket_path=None):
+    import logging
+    import socketserver
+    from control import serve_unix_socket
+
+    socket_path = socket_path or default_socket_path()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            version = 0
+            while True:
+                new_version, line = state.wait(version, CLIENT_CHECK_INTERVAL)
+                if new_version == version:
+                    # Nothing changed.  Stop if the client went away or the
+                    # server was closed, instead of waiting for the next change
+                    # to find out.
+                    if (_hung_up(self.connection)
+                            or self.server.socket.fileno() < 0):
+                        return
+                    continue
+                version = new_version
+                try:
+                    self.wfile.write((line + '\n').encode('utf-8'))
+                except OSError:
+                    return
+
+    server = serve_unix_socket(socket_path, Handler)
+    logging.info('Streaming workspace state on %s' % socket_path)
+    return server
+
+
+# Yields the states (as parsed JSON) streamed by the server.
+def read_states(socket_path=None):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or default_socket_path())
+        sock.shutdown(socket.SHUT_WR)
+        for line in sock.makefile('r', encoding='utf-8'):
+            yield json.loads(line)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description=
+        "Print the workspace state streamed by autoname_workspaces.py --state_socket, one line of JSON per change."
+    )
+    parser.add_argument('--output',
+                        help="Only print the workspaces of this output.")
+    parser.add_argument('--socket', help="Defaults to " + default_socket_path())
+    args = parser.parse_args()
+
+    last = None
+    try:
+        for state in read_states(args.socket):
+            if args.output is not None:
+                state = next((o['workspaces'] for o in state['outputs']
+                              if o['name'] == args.output), [])
+            line = json.dumps(state, ensure_ascii=False)
+            if line != last:
+                print(line, flush=True)
+                last = line
+    except (OSError, KeyboardInterrupt) as e:
+        sys.exit(str(e) or None)